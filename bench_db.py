@@ -0,0 +1,154 @@
+"""
+Benchmark do acesso ao SQLite dos usuários.
+
+Compara o jeito antigo (uma conexão nova por chamada, journal padrão) com
+get_db() do main.py (conexão por thread, WAL, statements em cache), com
+leituras puras e com uma carga mista de leituras e escritas em várias threads.
+
+Uso:
+    python bench_db.py [--users 1000] [--ops 20000] [--threads 4] [--writes 0.1]
+"""
+
+import argparse
+import os
+import shutil
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+# O main.py cria pastas e tabelas ao ser importado: aponta tudo para uma
+# pasta temporária antes do import (o banco de produção nunca é tocado)
+BENCH_DATA_DIR = tempfile.mkdtemp(prefix="bench_db_")
+os.environ["BOTECO_DATA_DIR"] = BENCH_DATA_DIR
+os.environ.pop("DB_PATH", None)
+os.environ.pop("COLD_FOLDER", None)
+
+import main  # noqa: E402
+
+
+def legacy_get_user(db_path: str, username: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.cursor()
+        c.execute("""
+        SELECT username, password, approved, admin, created_at
+        FROM users
+        WHERE username = ?
+        """, (username,))
+        return c.fetchone()
+    finally:
+        conn.close()
+
+
+def legacy_set_approved(db_path: str, username: str, approved: bool):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("UPDATE users SET approved=? WHERE username=?", (1 if approved else 0, username))
+    finally:
+        conn.close()
+
+
+def pooled_get_user(db_path: str, username: str):
+    return main.get_user(username)
+
+
+def pooled_set_approved(db_path: str, username: str, approved: bool):
+    main.set_approved(username, approved)
+
+
+def create_db(db_path: str, users: int):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            approved INTEGER NOT NULL DEFAULT 0,
+            admin INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """)
+        conn.executemany(
+            "INSERT INTO users (username, password, approved, admin, created_at) VALUES (?, ?, 0, 0, '')",
+            [(f"user{i}", "senha") for i in range(users)]
+        )
+    conn.close()
+
+
+def run(db_path: str, get_user, set_approved, users: int, ops: int, threads: int, write_ratio: float):
+    """
+    Executa 'ops' operações divididas entre 'threads' threads e retorna
+    (operações/s, erros "database is locked").
+    """
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = ops // threads
+
+    def worker(seed: int):
+        rnd = random.Random(seed)
+        local_errors = 0
+        for _ in range(per_thread):
+            username = f"user{rnd.randrange(users)}"
+            try:
+                if rnd.random() < write_ratio:
+                    set_approved(db_path, username, rnd.random() < 0.5)
+                else:
+                    get_user(db_path, username)
+            except sqlite3.OperationalError:
+                local_errors += 1
+        with lock:
+            errors[0] += local_errors
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, errors[0]
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--writes", type=float, default=0.1, help="fração de escritas na carga mista")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        pooled_db = os.path.join(tmp, "pooled.db")
+        create_db(legacy_db, args.users)
+        create_db(pooled_db, args.users)
+        # Os helpers do main.py passam a usar o banco temporário
+        main.close_db()
+        main.DB_PATH = pooled_db
+        # set_approved também grava a revogação de tokens assinados
+        main.init_session_revocations_db()
+
+        scenarios = [
+            ("leituras, 1 thread", 1, 0.0),
+            (f"leituras, {args.threads} threads", args.threads, 0.0),
+            (f"mista ({args.writes:.0%} escritas), {args.threads} threads", args.threads, args.writes),
+        ]
+        print(f"{'cenário':<40} {'antes (op/s)':>14} {'depois (op/s)':>14} {'locked antes/depois':>20}")
+        for label, threads, writes in scenarios:
+            before, before_err = run(legacy_db, legacy_get_user, legacy_set_approved,
+                                     args.users, args.ops, threads, writes)
+            after, after_err = run(pooled_db, pooled_get_user, pooled_set_approved,
+                                   args.users, args.ops, threads, writes)
+            print(f"{label:<40} {before:>14,.0f} {after:>14,.0f} {f'{before_err}/{after_err}':>20}")
+        main.close_db()
+
+
+if __name__ == "__main__":
+    try:
+        main_bench()
+    finally:
+        shutil.rmtree(BENCH_DATA_DIR, ignore_errors=True)
@@ -0,0 +1,109 @@
+"""
+Benchmark do login com senhas em scrypt.
+
+Cria usuários num banco temporário com o custo escolhido e dispara logins
+concorrentes direto no handler login_action do main.py (mesmo caminho de
+produção: leitura no pool do SQLite, verificação no pool do scrypt, sessão).
+Mede logins/s com senha certa e com senha errada, e a latência do event loop
+durante a carga (mostra que o KDF não trava o loop).
+
+Uso:
+    python bench_login.py [--n 16384] [--r 8] [--p 1] [--workers 2] [--logins 200] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# O main.py cria pastas e tabelas ao ser importado: aponta tudo para uma
+# pasta temporária antes do import (o banco de produção nunca é tocado)
+BENCH_DATA_DIR = tempfile.mkdtemp(prefix="bench_login_")
+os.environ["BOTECO_DATA_DIR"] = BENCH_DATA_DIR
+os.environ.pop("DB_PATH", None)
+os.environ.pop("COLD_FOLDER", None)
+
+import main  # noqa: E402
+
+# Requisição mínima para o handler (só o IP do cliente é usado)
+BENCH_REQUEST = main.Request({"type": "http", "client": ("127.0.0.1", 0), "headers": []})
+
+
+async def loop_lag(stop: asyncio.Event, samples: list):
+    """
+    Mede o atraso máximo de um sleep curto enquanto os logins rodam.
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append(time.perf_counter() - start - 0.005)
+
+
+async def run(users: int, logins: int, concurrency: int, correct: bool):
+    sem = asyncio.Semaphore(concurrency)
+    ok = [0]
+
+    async def one(i: int):
+        async with sem:
+            password = "senha" if correct else "errada"
+            response = await main.login_action(BENCH_REQUEST, username=f"user{i % users}", password=password)
+            if response.status_code == 302:
+                ok[0] += 1
+
+    stop = asyncio.Event()
+    samples = []
+    lag = asyncio.create_task(loop_lag(stop, samples))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag
+    return logins / elapsed, ok[0], max(samples, default=0.0)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=main.PASSWORD_SCRYPT_N)
+    parser.add_argument("--r", type=int, default=main.PASSWORD_SCRYPT_R)
+    parser.add_argument("--p", type=int, default=main.PASSWORD_SCRYPT_P)
+    parser.add_argument("--workers", type=int, default=main.PASSWORD_MAX_WORKERS)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    main.PASSWORD_SCRYPT_N, main.PASSWORD_SCRYPT_R, main.PASSWORD_SCRYPT_P = args.n, args.r, args.p
+    main.password_executor = main.ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="scrypt")
+    # Sessões ficam no banco temporário (sem tokens assinados)
+    main.SIGNED_SESSIONS = False
+    # O benchmark chama o handler direto: sem limite de tentativas por usuário
+    main.username_ip_limiter = main.TokenBucketLimiter(args.logins, 60.0 * args.logins)
+    main.username_limiter = main.TokenBucketLimiter(args.logins, 60.0 * args.logins)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Os helpers do main.py passam a usar o banco temporário
+        main.close_db()
+        main.DB_PATH = os.path.join(tmp, "bench.db")
+        main.init_db()
+        main.init_sessions_db()
+        start = time.perf_counter()
+        for i in range(args.users):
+            main.create_user(f"user{i}", "senha")
+        per_hash = (time.perf_counter() - start) / args.users
+
+        print(f"scrypt n={args.n} r={args.r} p={args.p}, {args.workers} workers, "
+              f"{per_hash * 1000:.1f} ms por hash")
+        print(f"{'cenário':<16} {'logins/s':>10} {'aceitos':>8} {'atraso máx. do loop':>20}")
+        for label, correct in (("senha certa", True), ("senha errada", False)):
+            rate, accepted, lag = asyncio.run(run(args.users, args.logins, args.concurrency, correct))
+            print(f"{label:<16} {rate:>10,.1f} {accepted:>8} {f'{lag * 1000:.1f} ms':>20}")
+        main.close_db()
+
+
+if __name__ == "__main__":
+    try:
+        main_bench()
+    finally:
+        shutil.rmtree(BENCH_DATA_DIR, ignore_errors=True)
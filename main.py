@@ -2,7 +2,13 @@ import os
 import asyncio
 import json
 import subprocess
+import shutil
 import threading
+import bisect
+import ctypes
+import ctypes.util
+import select
+import struct
 import uvicorn
 import requests
 import discord
@@ -10,32 +16,52 @@ from discord.ext import commands, tasks
 from fastapi import FastAPI, Request, HTTPException, Form, Cookie
 from fastapi.responses import (StreamingResponse, HTMLResponse,
                                FileResponse, PlainTextResponse,
-                               RedirectResponse)
+                               RedirectResponse, Response)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import time
 import uuid
+import hashlib
+import hmac
+import base64
+import re
+import heapq
+import itertools
+import unicodedata
 import sqlite3
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
 
 #########################################
 # CRIA A PASTA /db SE NÃO EXISTIR
 #########################################
-os.makedirs('/home/container/db', exist_ok=True)
+# Raiz de todos os dados (filmes, banco, saídas); os benchmarks apontam
+# para uma pasta temporária antes de importar este módulo.
+DATA_DIR = os.getenv("BOTECO_DATA_DIR", "/home/container")
+os.makedirs(os.path.join(DATA_DIR, "db"), exist_ok=True)
 
 #########################################
 # CONFIGURAÇÕES DE PASTAS
 #########################################
 
-VIDEO_FOLDER = "/home/container/filmes/"
-IMAGENS_FOLDER = "/home/container/imagens/"
-TRANSCODED_FOLDER = "/home/container/transcoded/"  # Pasta para salvar MP4 transcodificados
-LEGENDAS_FOLDER = "/home/container/legendas/"       # Pasta para legendas
+VIDEO_FOLDER = os.path.join(DATA_DIR, "filmes/")
+IMAGENS_FOLDER = os.path.join(DATA_DIR, "imagens/")
+TRANSCODED_FOLDER = os.path.join(DATA_DIR, "transcoded/")  # Pasta para salvar MP4 transcodificados
+LEGENDAS_FOLDER = os.path.join(DATA_DIR, "legendas/")       # Pasta para legendas
+HLS_FOLDER = os.path.join(DATA_DIR, "hls/")                 # Segmentos HLS gerados durante a transcodificação
+ABR_FOLDER = os.path.join(DATA_DIR, "abr/")                 # Escadas HLS multi-bitrate (1080p/720p/480p)
+COLD_FOLDER = os.getenv("COLD_FOLDER", os.path.join(DATA_DIR, "cold/"))  # Originais arquivados (política "cold")
 
 os.makedirs(VIDEO_FOLDER, exist_ok=True)
 os.makedirs(IMAGENS_FOLDER, exist_ok=True)
 os.makedirs(TRANSCODED_FOLDER, exist_ok=True)
 os.makedirs(LEGENDAS_FOLDER, exist_ok=True)
+os.makedirs(HLS_FOLDER, exist_ok=True)
+os.makedirs(ABR_FOLDER, exist_ok=True)
+os.makedirs(COLD_FOLDER, exist_ok=True)
 
 #########################################
 # INICIALIZAÇÃO DO FASTAPI
@@ -52,20 +78,55 @@ video_app.add_middleware(
 )
 
 video_app.mount("/imagens", StaticFiles(directory=IMAGENS_FOLDER), name="imagens")
-video_app.mount("/static", StaticFiles(directory="static"), name="static")
+video_app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
 video_app.mount("/legendas", StaticFiles(directory=LEGENDAS_FOLDER), name="legendas")
 
 #########################################
 # BANCO DE DADOS SQLITE PARA USUÁRIOS
 #########################################
 
-DB_PATH = "/home/container/db/boteco_users.db"
+DB_PATH = os.getenv("DB_PATH", os.path.join(DATA_DIR, "db", "boteco_users.db"))
+
+# Uma conexão por thread, aberta uma vez e reaproveitada. Com WAL, leituras
+# não esperam escritas e escritas concorrentes esperam (busy_timeout) em vez
+# de falhar com "database is locked". O sqlite3 guarda os statements
+# preparados por conexão (cached_statements), então o SQL fixo dos helpers
+# só é compilado uma vez por thread.
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHED_STATEMENTS = 256
+_db_local = threading.local()
+
+def get_db() -> sqlite3.Connection:
+    """
+    Retorna a conexão SQLite da thread atual. Use com 'with get_db() as conn:'
+    (o bloco faz commit/rollback, mas não fecha a conexão).
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               cached_statements=DB_CACHED_STATEMENTS)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        _db_local.conn = conn
+    return conn
+
+def close_db():
+    """
+    Fecha a conexão da thread atual (a próxima chamada a get_db abre outra).
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
 
 def init_db():
     """
     Cria a tabela 'users' se não existir, incluindo a coluna created_at.
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -83,21 +144,25 @@ def create_user(username: str, password: str):
     """
     Cria um novo usuário no DB com approved=0 e admin=0;
     registra a data/hora de criação (created_at).
+    A senha é gravada com hash (aceita também um hash já pronto).
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    if not is_password_hash(password):
+        password = hash_password(password)
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("""
         INSERT INTO users (username, password, approved, admin, created_at)
         VALUES (?, ?, 0, 0, ?)
         """, (username, password, datetime.now().isoformat()))
         conn.commit()
+    invalidate_principal(username)
 
 def get_user(username: str):
     """
     Retorna as informações do usuário (username, password, approved, admin, created_at)
     ou None se não encontrado.
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("""
         SELECT username, password, approved, admin, created_at
@@ -120,77 +185,685 @@ def set_approved(username: str, approved: bool):
     Define a coluna 'approved' de um usuário no DB.
     """
     val = 1 if approved else 0
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET approved=? WHERE username=?", (val, username))
         conn.commit()
+    invalidate_principal(username)
+    revoke_user_tokens(username)
 
 def delete_user(username: str):
     """
     Remove completamente o usuário do banco de dados.
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM users WHERE username=?", (username,))
         conn.commit()
+    invalidate_principal(username)
+    revoke_user_tokens(username)
+
+def update_password_hash(username: str, old_value: str, new_hash: str):
+    """
+    Troca a senha gravada (texto puro ou hash antigo) pelo hash novo, só se
+    ela não mudou desde a leitura.
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                  (new_hash, username, old_value))
+        conn.commit()
 
 def set_admin(username: str, is_admin: bool):
     """
     Define a coluna 'admin' de um usuário no DB.
     """
     val = 1 if is_admin else 0
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET admin=? WHERE username=?", (val, username))
         conn.commit()
+    invalidate_principal(username)
+    revoke_user_tokens(username)
 
 # Inicializa a tabela de usuários
 init_db()
 
+#########################################
+# ACESSO ASSÍNCRONO AO BANCO
+#########################################
+
+# Handlers async e o loop de transcodificação não chamam o sqlite3 direto:
+# as consultas rodam num pool próprio (cada thread com sua conexão de
+# get_db), então um banco lento nunca trava o event loop.
+DB_MAX_WORKERS = 4
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="sqlite")
+# Escritas sem resposta (estado da fila, metadados, estatísticas) vão para
+# uma thread só, o que mantém a ordem das gravações de um mesmo registro.
+db_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+
+async def run_db(func, *args):
+    """
+    Executa um helper de banco no pool do SQLite e espera o resultado.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, func, *args)
+
+def _report_db_write(future):
+    exc = future.exception()
+    if exc is not None:
+        print(f"[DB] Erro em escrita em segundo plano: {exc}")
+
+def queue_db_write(func, *args):
+    """
+    Agenda uma escrita sem esperar por ela (ordem de chegada preservada).
+    """
+    db_write_executor.submit(func, *args).add_done_callback(_report_db_write)
+
+#########################################
+# SENHAS (SCRYPT)
+#########################################
+
+# Formato gravado: scrypt$n$r$p$salt$hash (salt e hash em base64). O custo é
+# ajustável por ambiente; hashes com parâmetros antigos (e senhas ainda em
+# texto puro) são regravados no próximo login bem-sucedido.
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_SALT_BYTES = 16
+PASSWORD_HASH_BYTES = 32
+# O KDF é caro de propósito: roda num pool pequeno e separado para não
+# ocupar o event loop nem as threads do SQLite.
+PASSWORD_MAX_WORKERS = int(os.getenv("PASSWORD_MAX_WORKERS", "2"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_MAX_WORKERS, thread_name_prefix="scrypt")
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * (n + p + 2), dklen=PASSWORD_HASH_BYTES)
+
+def _parse_password_hash(value: str):
+    """
+    Retorna (n, r, p, salt, hash) de um valor no formato gravado, ou None se
+    o valor não for um hash válido.
+    """
+    parts = value.split("$")
+    if len(parts) != 6 or parts[0] != "scrypt":
+        return None
+    if not all(re.fullmatch(r"[0-9]{1,10}", x) for x in parts[1:4]):
+        return None
+    n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+    if n < 2 or n & (n - 1) or r < 1 or p < 1:
+        return None
+    try:
+        salt = base64.b64decode(parts[4], validate=True)
+        digest = base64.b64decode(parts[5], validate=True)
+    except ValueError:
+        return None
+    if not salt or len(digest) != PASSWORD_HASH_BYTES:
+        return None
+    return n, r, p, salt, digest
+
+def is_password_hash(value: str) -> bool:
+    return _parse_password_hash(value) is not None
+
+def hash_password(password: str) -> str:
+    n, r, p = PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return "scrypt${}${}${}${}${}".format(n, r, p, base64.b64encode(salt).decode("ascii"),
+                                          base64.b64encode(digest).decode("ascii"))
+
+def check_password(stored: str, password: str):
+    """
+    Confere a senha com o valor gravado. Retorna (ok, novo_hash): novo_hash
+    vem preenchido quando a senha confere mas o valor gravado precisa ser
+    regravado (texto puro ou custo diferente do atual).
+    """
+    parsed = _parse_password_hash(stored)
+    if parsed is None:
+        # Texto puro: roda o scrypt do mesmo jeito, para o tempo de resposta
+        # não revelar quais contas ainda não migraram
+        check_password(_DUMMY_PASSWORD_HASH, password)
+        ok = hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        return ok, (hash_password(password) if ok else None)
+    n, r, p, salt, digest = parsed
+    ok = hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+    outdated = (n, r, p) != (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return ok, (hash_password(password) if ok and outdated else None)
+
+# Usado quando o usuário não existe, para o login demorar o mesmo tanto
+# (não revela quais usuários existem pelo tempo de resposta).
+_DUMMY_PASSWORD_HASH = hash_password(uuid.uuid4().hex)
+
+async def run_password(func, *args):
+    """
+    Executa hash/verificação de senha no pool do scrypt.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, func, *args)
+
 #########################################
 # AUTENTICAÇÃO / SESSÃO / APROVAÇÃO DE USUÁRIOS
 #########################################
 
 SESSION_COOKIE_NAME = "session_id"
 
-# Dicionário em memória: session_id -> username
-active_sessions = {}
+# Sessões ficam no SQLite (sobrevivem a reinícios e são compartilhadas entre
+# workers do uvicorn) e expiram depois de SESSION_TTL_S.
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", str(30 * 24 * 3600)))
+SESSION_SWEEP_INTERVAL_S = 3600
+# Cache local de leitura: session_id -> (username ou None, expira_em, lido_em).
+# Um logout feito em outro worker leva até SESSION_CACHE_TTL_S para valer aqui.
+SESSION_CACHE_TTL_S = 30.0
+SESSION_CACHE_MAX = 10000
+session_cache = OrderedDict()
+session_cache_lock = threading.Lock()
+
+def init_sessions_db():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+        conn.commit()
+
+init_sessions_db()
+
+def _session_cache_put(session_id: str, username, expires_at: float):
+    with session_cache_lock:
+        session_cache[session_id] = (username, expires_at, time.monotonic())
+        session_cache.move_to_end(session_id)
+        while len(session_cache) > SESSION_CACHE_MAX:
+            session_cache.popitem(last=False)
+
+def _session_cache_get(session_id: str):
+    """
+    Retorna (achou, username) olhando só o cache local.
+    """
+    with session_cache_lock:
+        entry = session_cache.get(session_id)
+    if entry is None:
+        return False, None
+    username, expires_at, cached_at = entry
+    if time.monotonic() - cached_at > SESSION_CACHE_TTL_S:
+        return False, None
+    if username is not None and time.time() >= expires_at:
+        return True, None
+    return True, username
+
+# Permissões resolvidas de um usuário (imutável). 'approved' já considera
+# admins como aprovados; 'exists' é False para quem não está no banco.
+UserPrincipal = namedtuple("UserPrincipal", ["username", "approved", "admin", "exists"])
+
+# username -> (UserPrincipal, lido_em). set_approved, set_admin, delete_user
+# e create_user invalidam a entrada; o TTL cobre mudanças feitas por outro
+# worker do uvicorn.
+PRINCIPAL_CACHE_TTL_S = 60.0
+principal_cache = {}
+principal_cache_lock = threading.Lock()
+
+def _cached_principal(username: str):
+    with principal_cache_lock:
+        entry = principal_cache.get(username)
+    if entry is not None and time.monotonic() - entry[1] <= PRINCIPAL_CACHE_TTL_S:
+        return entry[0]
+    return None
+
+def get_principal(username: str) -> UserPrincipal:
+    """
+    Resolve aprovação e admin com uma única consulta (ou nenhuma, se em cache).
+    """
+    principal = _cached_principal(username)
+    if principal is not None:
+        return principal
+    user_data = get_user(username)
+    # 'eletriom' é sempre admin, mesmo sem registro no banco
+    admin = username == "eletriom" or bool(user_data and user_data["admin"])
+    principal = UserPrincipal(
+        username=username,
+        approved=admin or bool(user_data and user_data["approved"]),
+        admin=admin,
+        exists=user_data is not None,
+    )
+    with principal_cache_lock:
+        principal_cache[username] = (principal, time.monotonic())
+    return principal
+
+async def get_principal_async(username: str) -> UserPrincipal:
+    principal = _cached_principal(username)
+    if principal is not None:
+        return principal
+    return await run_db(get_principal, username)
+
+def invalidate_principal(username: str):
+    with principal_cache_lock:
+        principal_cache.pop(username, None)
 
 def is_admin(username: str) -> bool:
     """
     Verifica se é o admin 'eletriom' ou se o usuário tem flag 'admin' = True no DB.
     """
-    if username == "eletriom":
-        return True
-    user_data = get_user(username)
-    if user_data and user_data["admin"]:
-        return True
-    return False
+    return get_principal(username).admin
 
 def is_approved_user(username: str) -> bool:
     """
     Verifica se o usuário é admin ou está aprovado no DB.
     """
-    if is_admin(username):
-        return True
-    user_data = get_user(username)
-    if user_data and user_data["approved"]:
-        return True
-    return False
+    return get_principal(username).approved
 
 def create_session(username: str):
     """
-    Cria um session_id único e associa ao username em 'active_sessions'.
+    Cria um session_id único, válido por SESSION_TTL_S, e associa ao username.
+    Com SESSION_SECRET definido, retorna um token assinado (sem estado no banco).
     """
+    if SIGNED_SESSIONS:
+        return issue_session_token(get_principal(username))
     session_id = str(uuid.uuid4())
-    active_sessions[session_id] = username
+    now = time.time()
+    expires_at = now + SESSION_TTL_S
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO sessions (session_id, username, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                  (session_id, username, now, expires_at))
+        conn.commit()
+    _session_cache_put(session_id, username, expires_at)
     return session_id
 
 def get_current_username_from_session(session_id: str):
     """
-    Retorna o username associado a este session_id, ou None se inválido.
+    Retorna o username associado a este session_id, ou None se inválido ou
+    expirado. Consulta o banco só quando o cache local não tem a resposta.
+    """
+    if not session_id:
+        return None
+    found, username = _session_cache_get(session_id)
+    if found:
+        return username
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT username, expires_at FROM sessions WHERE session_id = ? AND expires_at > ?",
+                  (session_id, time.time()))
+        row = c.fetchone()
+    # Ids desconhecidos também entram no cache (cookie inválido não martela o banco)
+    if row:
+        _session_cache_put(session_id, row[0], row[1])
+        return row[0]
+    _session_cache_put(session_id, None, 0.0)
+    return None
+
+async def session_username(session_id: str):
+    """
+    Versão para handlers async: acerto no cache é resolvido na hora, sem
+    passar pelo pool do banco.
+    """
+    if not session_id:
+        return None
+    found, username = _session_cache_get(session_id)
+    if found:
+        return username
+    return await run_db(get_current_username_from_session, session_id)
+
+def delete_session(session_id: str):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+    with session_cache_lock:
+        session_cache.pop(session_id, None)
+
+def sweep_expired_sessions() -> int:
+    """
+    Apaga as sessões vencidas (e revogações que não servem mais) e retorna
+    quantas sessões foram removidas.
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        removed = c.rowcount
+        c.execute("DELETE FROM session_revocations WHERE expires_at <= ?", (time.time(),))
+        # Tokens emitidos antes disso já expiraram de qualquer jeito
+        c.execute("DELETE FROM session_not_before WHERE not_before <= ?", (time.time() - SESSION_TTL_S,))
+        conn.commit()
+    now = time.time()
+    with session_cache_lock:
+        for sid in [sid for sid, (_, expires_at, _) in session_cache.items() if 0 < expires_at <= now]:
+            del session_cache[sid]
+    return removed
+
+#########################################
+# SESSÕES ASSINADAS (HMAC)
+#########################################
+
+# Opcional: com SESSION_SECRET definido (o mesmo em todas as instâncias), o
+# cookie de sessão é um token "v1.<payload>.<assinatura>" com usuário,
+# permissões, emissão, validade e um id (jti). Qualquer instância valida o
+# token sem consultar sessões; só a lista de revogação é compartilhada:
+#   - logout revoga o jti até o token vencer;
+#   - mudança de papel (aprovar, admin, remover) grava um "not before" para o
+#     usuário; tokens mais antigos são reavaliados no banco e reemitidos.
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SIGNED_SESSIONS = bool(SESSION_SECRET)
+if SIGNED_SESSIONS and len(SESSION_SECRET) < 32:
+    print("[Sessões] Aviso: SESSION_SECRET curto, use pelo menos 32 caracteres")
+SESSION_TOKEN_PREFIX = "v1."
+# Com que frequência cada instância relê a lista de revogação do banco
+SESSION_REVOCATION_REFRESH_S = 5.0
+
+revoked_jtis = set()
+user_not_before = {}
+_revocations_loaded_at = 0.0
+
+def init_session_revocations_db():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            jti TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS session_not_before (
+            username TEXT PRIMARY KEY,
+            not_before REAL NOT NULL
+        )
+        """)
+        conn.commit()
+
+init_session_revocations_db()
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(message: bytes) -> bytes:
+    return _b64url(hmac.new(SESSION_SECRET.encode("utf-8"), message, hashlib.sha256).digest()).encode("ascii")
+
+def issue_session_token(principal: UserPrincipal) -> str:
+    now = time.time()
+    claims = {
+        "u": principal.username,
+        "ap": principal.approved,
+        "ad": principal.admin,
+        # Nunca antes do "not before" do usuário: um token reemitido não pode
+        # nascer já vencido pela revogação (o que o faria ser reemitido de novo
+        # a cada requisição, com relógios um pouco diferentes entre instâncias)
+        "iat": max(now, user_not_before.get(principal.username, 0.0)),
+        "exp": now + SESSION_TTL_S,
+        "jti": uuid.uuid4().hex,
+    }
+    payload = _b64url(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signature = _sign((SESSION_TOKEN_PREFIX + payload).encode("ascii")).decode("ascii")
+    return f"{SESSION_TOKEN_PREFIX}{payload}.{signature}"
+
+def verify_session_token(token: str) -> dict | None:
+    """
+    Retorna as claims se a assinatura confere, o token não venceu e não foi
+    revogado por logout; None caso contrário (inclusive para cookies
+    malformados, que vêm do cliente).
+    """
+    if not token.startswith(SESSION_TOKEN_PREFIX) or not token.isascii():
+        return None
+    try:
+        payload, signature = token[len(SESSION_TOKEN_PREFIX):].split(".")
+        expected = _sign((SESSION_TOKEN_PREFIX + payload).encode("ascii"))
+        if not hmac.compare_digest(signature.encode("ascii"), expected):
+            return None
+        claims = json.loads(_b64url_decode(payload))
+        if claims["exp"] <= time.time() or claims["jti"] in revoked_jtis:
+            return None
+    except (ValueError, TypeError, KeyError):
+        return None
+    return claims
+
+def load_session_revocations():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT jti FROM session_revocations WHERE expires_at > ?", (time.time(),))
+        jtis = {row[0] for row in c.fetchall()}
+        c.execute("SELECT username, not_before FROM session_not_before")
+        not_before = {row[0]: row[1] for row in c.fetchall()}
+    return jtis, not_before
+
+async def refresh_session_revocations():
+    """
+    Relê a lista de revogação se a cópia local tiver mais de
+    SESSION_REVOCATION_REFRESH_S (pega logouts feitos em outras instâncias).
+    """
+    global revoked_jtis, user_not_before, _revocations_loaded_at
+    if time.monotonic() - _revocations_loaded_at < SESSION_REVOCATION_REFRESH_S:
+        return
+    _revocations_loaded_at = time.monotonic()
+    revoked_jtis, user_not_before = await run_db(load_session_revocations)
+
+def revoke_session_token(claims: dict):
+    revoked_jtis.add(claims["jti"])
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO session_revocations (jti, expires_at) VALUES (?, ?)",
+                  (claims["jti"], claims["exp"]))
+        conn.commit()
+
+def revoke_user_tokens(username: str):
+    """
+    Tokens do usuário emitidos até agora passam a ser reavaliados no banco.
+    Sessões no SQLite já resolvem o papel a cada requisição: nada a gravar.
+    """
+    if not SIGNED_SESSIONS:
+        return
+    now = time.time()
+    user_not_before[username] = now
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO session_not_before (username, not_before) VALUES (?, ?)",
+                  (username, now))
+        conn.commit()
+
+async def session_principal(request: Request) -> UserPrincipal | None:
+    """
+    Usuário da requisição (cookie de sessão) com as permissões resolvidas,
+    ou None se não houver sessão válida.
+    """
+    session_id = request.cookies.get(SESSION_COOKIE_NAME)
+    if not session_id:
+        return None
+    if SIGNED_SESSIONS and session_id.startswith(SESSION_TOKEN_PREFIX):
+        await refresh_session_revocations()
+        claims = verify_session_token(session_id)
+        if claims is None:
+            return None
+        stale = claims["iat"] < user_not_before.get(claims["u"], 0.0)
+        if not stale and claims["exp"] - time.time() > SESSION_TTL_S / 2:
+            return UserPrincipal(claims["u"], claims["ap"], claims["ad"], True)
+        # Papel mudou ou o token passou da metade da validade: reavalia no
+        # banco e o SessionCookieMiddleware devolve um token novo
+        principal = await get_principal_async(claims["u"])
+        if not principal.exists and not principal.admin:
+            # Usuário removido: apaga o cookie em vez de reavaliar toda vez
+            request.state.session_token = ""
+            return None
+        request.state.session_token = issue_session_token(principal)
+        return principal
+    username = await session_username(session_id)
+    if not username:
+        return None
+    return await get_principal_async(username)
+
+class SessionCookieMiddleware:
+    """
+    Middleware ASGI puro (não interfere no streaming de arquivos): se o handler
+    reemitiu o token de sessão, acrescenta o Set-Cookie na resposta (com o
+    mesmo nome/Path, substitui o cookie antigo). Token "" apaga o cookie.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SIGNED_SESSIONS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                token = scope.get("state", {}).get("session_token")
+                if token is not None:
+                    max_age = SESSION_TTL_S if token else 0
+                    cookie = (f"{SESSION_COOKIE_NAME}={token}; HttpOnly; Max-Age={max_age}; "
+                              f"Path=/; SameSite=lax")
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"set-cookie", cookie.encode("latin-1"))]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+video_app.add_middleware(SessionCookieMiddleware)
+
+#########################################
+# LIMITE DE TENTATIVAS (LOGIN/REGISTRO)
+#########################################
+
+# Token bucket em memória: cada chave ganha 'rate' fichas por segundo até
+# 'burst'. O limite por IP roda num middleware ASGI, antes de ler o
+# formulário, e toda tentativa gasta uma ficha. O limite por usuário é
+# conferido no topo dos handlers (antes do banco, do scrypt e do Discord),
+# mas só tentativas que falharam gastam fichas, e a chave estrita é
+# (usuário, IP): quem erra a senha de outro IP não tranca o dono da conta. O
+# limite global por usuário é folgado e só segura ataques de vários IPs.
+#
+# O IP é o scope["client"] do uvicorn. Atrás de um proxy reverso, defina
+# FORWARDED_ALLOW_IPS com o endereço do proxy (repassado ao uvicorn.run)
+# para o X-Forwarded-For ser usado; senão todos dividem o bucket do proxy.
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "10"))
+LOGIN_IP_PER_MIN = float(os.getenv("LOGIN_IP_PER_MIN", "10"))
+REGISTER_IP_BURST = int(os.getenv("REGISTER_IP_BURST", "3"))
+REGISTER_IP_PER_MIN = float(os.getenv("REGISTER_IP_PER_MIN", "1"))
+USERNAME_IP_BURST = int(os.getenv("USERNAME_IP_BURST", "5"))
+USERNAME_IP_PER_MIN = float(os.getenv("USERNAME_IP_PER_MIN", "5"))
+USERNAME_BURST = int(os.getenv("USERNAME_BURST", "30"))
+USERNAME_PER_MIN = float(os.getenv("USERNAME_PER_MIN", "30"))
+RATE_LIMIT_MAX_KEYS = 50000
+RATE_LIMIT_SHARDS = 16
+RATE_LIMIT_RETRY_AFTER_S = 60
+
+class TokenBucketLimiter:
+    """
+    Buckets divididos em shards (um lock e um OrderedDict por shard); cada
+    shard guarda no máximo max_keys/shards chaves e descarta a menos usada.
+    Um bucket descartado volta cheio, o que só favorece quem ficou parado.
+    """
+
+    def __init__(self, burst: int, per_min: float, max_keys: int = RATE_LIMIT_MAX_KEYS,
+                 shards: int = RATE_LIMIT_SHARDS):
+        self.burst = float(burst)
+        self.rate = per_min / 60.0
+        self.max_per_shard = max(1, max_keys // shards)
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+
+    def _take(self, key: str, consume: bool, only_if_available: bool) -> bool:
+        lock, buckets = self.shards[hash(key) % len(self.shards)]
+        now = time.monotonic()
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if not consume:
+                    return True
+                bucket = [self.burst, now]
+                buckets[key] = bucket
+                if len(buckets) > self.max_per_shard:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            available = bucket[0] >= 1.0
+            if consume and (available or not only_if_available):
+                bucket[0] = max(0.0, bucket[0] - 1.0)
+            return available
+
+    def allow(self, key: str) -> bool:
+        """
+        Gasta uma ficha se houver; False se o bucket estiver vazio.
+        """
+        return self._take(key, consume=True, only_if_available=True)
+
+    def blocked(self, key: str) -> bool:
+        """
+        True se o bucket estiver vazio (não gasta ficha).
+        """
+        return not self._take(key, consume=False, only_if_available=True)
+
+    def charge(self, key: str):
+        """
+        Gasta uma ficha depois de uma tentativa que falhou.
+        """
+        self._take(key, consume=True, only_if_available=False)
+
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MIN)
+register_ip_limiter = TokenBucketLimiter(REGISTER_IP_BURST, REGISTER_IP_PER_MIN)
+username_ip_limiter = TokenBucketLimiter(USERNAME_IP_BURST, USERNAME_IP_PER_MIN)
+username_limiter = TokenBucketLimiter(USERNAME_BURST, USERNAME_PER_MIN)
+
+def _username_keys(request: Request, username: str) -> tuple:
+    ip = request.client.host if request.client else ""
+    return f"{username}|{ip}", username
+
+def username_rate_limited(request: Request, username: str) -> bool:
+    strict_key, global_key = _username_keys(request, username)
+    return username_ip_limiter.blocked(strict_key) or username_limiter.blocked(global_key)
+
+def charge_username_failure(request: Request, username: str):
+    strict_key, global_key = _username_keys(request, username)
+    username_ip_limiter.charge(strict_key)
+    username_limiter.charge(global_key)
+
+# Resposta pronta (sem HTML montado por requisição): recusar custa quase nada
+RATE_LIMITED_RESPONSE = Response(
+    content=b"Muitas tentativas. Aguarde um pouco e tente de novo.",
+    status_code=429,
+    media_type="text/plain; charset=utf-8",
+    headers={"Retry-After": str(RATE_LIMIT_RETRY_AFTER_S), "Cache-Control": "no-store"},
+)
+
+class AuthRateLimitMiddleware:
+    """
+    Middleware ASGI puro: aplica o limite por IP aos POSTs de /login e
+    /register e responde 429 sem ler o corpo da requisição.
     """
-    return active_sessions.get(session_id)
+
+    LIMITERS = {"/login": login_ip_limiter, "/register": register_ip_limiter}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limiter = self.LIMITERS.get(scope["path"])
+            client = scope.get("client")
+            if limiter is not None and client and not limiter.allow(client[0]):
+                await RATE_LIMITED_RESPONSE(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+video_app.add_middleware(AuthRateLimitMiddleware)
+
+async def session_sweep_loop():
+    while True:
+        try:
+            removed = await run_db(sweep_expired_sessions)
+            if removed:
+                print(f"[Sessões] {removed} sessão(ões) expirada(s) removida(s)")
+        except Exception as e:
+            print(f"[Sessões] Erro ao limpar sessões: {e}")
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_S)
 
 #########################################
 # FUNÇÕES DISCORD: APROVAÇÃO DE USUÁRIOS
@@ -207,9 +880,9 @@ class ApproveDenyView(discord.ui.View):
     @discord.ui.button(label="Aprovar", style=discord.ButtonStyle.green)
     async def approve_button(self, button: discord.ui.Button, interaction: discord.Interaction):
         # Se o usuário existe, aprova
-        user_data = get_user(self.username)
+        user_data = await run_db(get_user, self.username)
         if user_data:
-            set_approved(self.username, True)
+            await run_db(set_approved, self.username, True)
             await interaction.response.send_message(
                 f"Usuário **{self.username}** aprovado!",
                 ephemeral=True
@@ -231,9 +904,9 @@ class ApproveDenyView(discord.ui.View):
     @discord.ui.button(label="Negar", style=discord.ButtonStyle.red)
     async def deny_button(self, button: discord.ui.Button, interaction: discord.Interaction):
         # Se o usuário existe, remove do DB
-        user_data = get_user(self.username)
+        user_data = await run_db(get_user, self.username)
         if user_data:
-            delete_user(self.username)
+            await run_db(delete_user, self.username)
             await interaction.response.send_message(
                 f"Usuário **{self.username}** removido/negado!",
                 ephemeral=True
@@ -389,18 +1062,27 @@ def login_page():
     return HTMLResponse(html)
 
 @video_app.post("/login")
-def login_action(username: str = Form(...), password: str = Form(...)):
+async def login_action(request: Request, username: str = Form(...), password: str = Form(...)):
     username = username.strip().lower()
-    user_data = get_user(username)
-
-    if user_data and user_data["password"] == password:
+    if username_rate_limited(request, username):
+        return RATE_LIMITED_RESPONSE
+    user_data = await run_db(get_user, username)
+    stored = user_data["password"] if user_data else _DUMMY_PASSWORD_HASH
+    ok, new_hash = await run_password(check_password, stored, password)
+
+    if user_data and ok:
+        if new_hash:
+            # Migra senha em texto puro / hash com custo antigo
+            queue_db_write(update_password_hash, username, stored, new_hash)
         # Cria sessão
-        session_id = create_session(username)
+        session_id = await run_db(create_session, username)
         response = RedirectResponse(url="/", status_code=302)
-        response.set_cookie(key=SESSION_COOKIE_NAME, value=session_id, httponly=True)
+        response.set_cookie(key=SESSION_COOKIE_NAME, value=session_id, httponly=True,
+                            max_age=SESSION_TTL_S, samesite="lax")
         return response
 
     # Caso contrário, credenciais inválidas
+    charge_username_failure(request, username)
     html = """
     <!DOCTYPE html>
     <html>
@@ -581,8 +1263,10 @@ def register_page():
     return HTMLResponse(html)
 
 @video_app.post("/register")
-def register_action(request: Request, username: str = Form(...), password: str = Form(...)):
+async def register_action(request: Request, username: str = Form(...), password: str = Form(...)):
     username = username.strip().lower()
+    if username_rate_limited(request, username):
+        return RATE_LIMITED_RESPONSE
     if not username or not password:
         html = """
         <!DOCTYPE html>
@@ -642,7 +1326,9 @@ def register_action(request: Request, username: str = Form(...), password: str =
         return HTMLResponse(html, status_code=400)
 
     # Verifica se usuário já existe ou se for "eletriom"
-    if get_user(username) is not None or username == "eletriom":
+    if username == "eletriom" or await run_db(get_user, username) is not None:
+        # Sondar nomes existentes conta como tentativa que falhou
+        charge_username_failure(request, username)
         html = """
         <!DOCTYPE html>
         <html>
@@ -701,7 +1387,8 @@ def register_action(request: Request, username: str = Form(...), password: str =
         return HTMLResponse(html, status_code=400)
 
     # Cria usuário no DB com approved=False, admin=False
-    create_user(username, password)
+    password_hash = await run_password(hash_password, password)
+    await run_db(create_user, username, password_hash)
 
     # Dispara mensagem no canal de aprovação do Discord
     # Canal: 1250962809756454932
@@ -775,10 +1462,13 @@ def register_action(request: Request, username: str = Form(...), password: str =
     return HTMLResponse(html)
 
 @video_app.get("/logout")
-def logout_action(request: Request):
+async def logout_action(request: Request):
     session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    if session_id in active_sessions:
-        del active_sessions[session_id]
+    claims = verify_session_token(session_id) if SIGNED_SESSIONS and session_id else None
+    if claims is not None:
+        await run_db(revoke_session_token, claims)
+    elif session_id:
+        await run_db(delete_session, session_id)
     response = RedirectResponse(url="/login", status_code=302)
     response.delete_cookie(SESSION_COOKIE_NAME)
     return response
@@ -788,14 +1478,13 @@ def logout_action(request: Request):
 #########################################
 
 @video_app.get("/admin", response_class=HTMLResponse)
-def admin_panel(request: Request):
+async def admin_panel(request: Request):
     """
     Página para somente definir outro usuário como admin.
     Somente admins podem acessar.
     """
-    session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    current_user = get_current_username_from_session(session_id)
-    if not current_user or not is_admin(current_user):
+    principal = await session_principal(request)
+    if not principal or not principal.admin:
         # Acesso negado
         html = """
         <!DOCTYPE html>
@@ -857,7 +1546,7 @@ def admin_panel(request: Request):
     # Monta form para setar admin
     top_bar = f"""
     <div class="top-bar">
-        <div class="title">Bem-vindo, {current_user} (Admin)!</div>
+        <div class="title">Bem-vindo, {principal.username} (Admin)!</div>
         <div class="menu">
             <a href="/logout" class="btn">Logout</a>
         </div>
@@ -981,10 +1670,9 @@ def admin_panel(request: Request):
     return HTMLResponse(html)
 
 @video_app.post("/admin/set_admin")
-def admin_set_user_as_admin(request: Request, username: str = Form(...)):
-    session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    current_user = get_current_username_from_session(session_id)
-    if not current_user or not is_admin(current_user):
+async def admin_set_user_as_admin(request: Request, username: str = Form(...)):
+    principal = await session_principal(request)
+    if not principal or not principal.admin:
         html = """
         <!DOCTYPE html>
         <html>
@@ -1000,11 +1688,11 @@ def admin_set_user_as_admin(request: Request, username: str = Form(...)):
         return HTMLResponse(html, status_code=403)
 
     username = username.strip().lower()
-    user_data = get_user(username)
+    user_data = await run_db(get_user, username)
     if not user_data:
         return HTMLResponse(f"<p>Usuário '{username}' não encontrado.</p><a href='/admin'>Voltar</a>", status_code=400)
 
-    set_admin(username, True)
+    await run_db(set_admin, username, True)
     return RedirectResponse(url="/admin", status_code=302)
 
 #########################################
@@ -1012,7 +1700,95 @@ def admin_set_user_as_admin(request: Request, username: str = Form(...)):
 #########################################
 
 transcoding_progress = {}
-transcoding_tasks = {}
+
+#########################################
+# PROGRESSO EM TEMPO REAL (SSE)
+#########################################
+
+# Intervalo mínimo entre dois envios para o mesmo arquivo; atualizações no
+# meio do caminho são agrupadas e só a mais recente é enviada.
+PROGRESS_PUSH_INTERVAL_S = float(os.getenv("PROGRESS_PUSH_INTERVAL_S", "0.5"))
+PROGRESS_KEEPALIVE_S = 15.0
+
+def progress_snapshot(filename: str) -> dict:
+    """
+    Estado atual da transcodificação, no formato usado por /progress e pelo SSE.
+    """
+    info = transcoding_progress.get(filename)
+    if info is None:
+        return {"percent": 0.0, "eta": 0.0, "status": "not_found"}
+    return {
+        "percent": info["percent"],
+        "eta": info["eta"],
+        "status": info["status"],
+        "position": transcode_queue.position(filename),
+        "playable": (info["status"] == "in_progress" and TRANSCODE_PROGRESSIVE
+                     and hls_playable(filename)),
+    }
+
+class ProgressBroadcaster:
+    """
+    Distribui o progresso de cada arquivo para todos os inscritos (uma fila
+    de tamanho 1 por conexão, então clientes lentos só recebem o último estado).
+    """
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.subscribers = {}   # filename -> set de asyncio.Queue
+        self._last_push = {}    # filename -> time.monotonic() do último envio
+        self._pending = {}      # filename -> TimerHandle do envio agendado
+
+    def subscribe(self, filename: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(filename, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, filename: str, queue: asyncio.Queue):
+        subs = self.subscribers.get(filename)
+        if subs is None:
+            return
+        subs.discard(queue)
+        if not subs:
+            del self.subscribers[filename]
+            self._last_push.pop(filename, None)
+            handle = self._pending.pop(filename, None)
+            if handle:
+                handle.cancel()
+
+    def publish(self, filename: str, force: bool = False):
+        """
+        Avisa que o progresso mudou. Sem inscritos não custa nada; com
+        inscritos, envia no máximo uma vez por intervalo (force envia já).
+        """
+        if filename not in self.subscribers:
+            return
+        handle = self._pending.get(filename)
+        if handle is not None:
+            if not force:
+                return
+            handle.cancel()
+            del self._pending[filename]
+        wait = self._last_push.get(filename, 0.0) + self.interval_s - time.monotonic()
+        if force or wait <= 0:
+            self._flush(filename)
+        else:
+            loop = asyncio.get_running_loop()
+            self._pending[filename] = loop.call_later(wait, self._flush, filename)
+
+    def _flush(self, filename: str):
+        self._pending.pop(filename, None)
+        subs = self.subscribers.get(filename)
+        if not subs:
+            return
+        self._last_push[filename] = time.monotonic()
+        # Serializa uma vez só para todos os inscritos
+        payload = f"data: {json.dumps(progress_snapshot(filename))}\n\n".encode("utf-8")
+        for queue in subs:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+progress_broadcaster = ProgressBroadcaster(PROGRESS_PUSH_INTERVAL_S)
 
 #########################################
 # FUNÇÕES AUXILIARES
@@ -1024,182 +1800,3102 @@ def format_title(filename: str) -> str:
 
 def get_cover_image(filename: str) -> str:
     base = os.path.splitext(filename)[0]
-    possible_exts = [".jpg", ".jpeg", ".png", ".webp"]
-    for ext in possible_exts:
-        candidate = os.path.join(IMAGENS_FOLDER, base + ext)
-        if os.path.isfile(candidate):
-            return f"/imagens/{os.path.basename(candidate)}"
+    cover = asset_maps["capas"].get(base)
+    if cover is not None:
+        asset_stats["cover_hits"] += 1
+        return f"/imagens/{cover}"
+    asset_stats["cover_misses"] += 1
     return "/imagens/no_image.jpg"
 
 def get_subtitle_path(filename: str) -> str | None:
     base = os.path.splitext(filename)[0]
-    possible_exts = [".vtt", ".srt"]
-    for ext in possible_exts:
-        candidate = os.path.join(LEGENDAS_FOLDER, base + ext)
-        if os.path.isfile(candidate):
-            return candidate
+    subtitle = asset_maps["legendas"].get(base)
+    if subtitle is not None:
+        asset_stats["subtitle_hits"] += 1
+        return os.path.join(LEGENDAS_FOLDER, subtitle)
+    asset_stats["subtitle_misses"] += 1
     return None
 
-async def get_video_duration_s(file_path: str) -> float:
-    cmd = [
-        "ffprobe",
-        "-v", "quiet",
-        "-print_format", "json",
-        "-show_format",
-        file_path
-    ]
-    try:
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await process.communicate()
-        info = json.loads(stdout.decode())
-        fmt = info.get("format", {})
-        dur_str = fmt.get("duration", "0")
-        return float(dur_str)
-    except:
-        return 0.0
-
-async def transcode_file(original_file: str, transcoded_path: str):
-    filename = os.path.basename(original_file)
-    duration_s = await get_video_duration_s(original_file)
-    if duration_s <= 0:
-        duration_s = 1
-
-    transcoding_progress[filename] = {
-        "percent": 0.0,
-        "eta": 0.0,
-        "status": "in_progress",
-        "start_time": time.time(),
-        "duration_s": duration_s,
-    }
-
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", original_file,
-        "-c:v", "copy",
-        "-c:a", "aac", "-b:a", "192k",
-        "-movflags", "faststart",
-        "-progress", "pipe:2",
-        "-nostats",
-        transcoded_path
-    ]
-
-    print(f"[Transcode] Iniciando: {original_file} -> {transcoded_path}")
+async def run_ffmpeg(cmd: list, on_out_time=None) -> int:
+    """
+    Roda o ffmpeg (com '-progress pipe:2') e chama on_out_time(segundos)
+    a cada atualização de progresso. Retorna o código de saída.
+    """
     process = await asyncio.create_subprocess_exec(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE
     )
-
     while True:
         line = await process.stderr.readline()
         if not line:
             break
-        decoded = line.decode().strip()
-        if "out_time_ms=" in decoded:
-            val_str = decoded.split("=")[1].strip()
+        decoded = line.decode(errors="replace").strip()
+        if on_out_time is not None and "out_time_ms=" in decoded:
             try:
-                out_time_ms = float(val_str)
-                out_time_s = out_time_ms / 1_000_000.0
-                pct = (out_time_s / duration_s) * 100
-                pct = max(0, min(pct, 100))
-                elapsed = time.time() - transcoding_progress[filename]["start_time"]
-                speed = out_time_s / elapsed if elapsed > 0 else 0
-                if speed > 0:
-                    remaining_s = (duration_s - out_time_s) / speed
-                else:
-                    remaining_s = 0
-
-                transcoding_progress[filename]["percent"] = pct
-                transcoding_progress[filename]["eta"] = remaining_s
-            except:
+                on_out_time(float(decoded.split("=")[1].strip()) / 1_000_000.0)
+            except ValueError:
                 pass
-
     await process.wait()
-    if process.returncode != 0:
+    return process.returncode
+
+def update_transcode_progress(filename: str, done_s: float):
+    """
+    Atualiza percentual e ETA a partir dos segundos já processados.
+    """
+    info = transcoding_progress[filename]
+    duration_s = info["duration_s"]
+    pct = max(0, min((done_s / duration_s) * 100, 100))
+    elapsed = time.time() - info["start_time"]
+    speed = done_s / elapsed if elapsed > 0 else 0
+    info["percent"] = pct
+    info["eta"] = (duration_s - done_s) / speed if speed > 0 else 0
+    progress_broadcaster.publish(filename)
+
+async def transcode_file(original_file: str, transcoded_path: str, background: bool = False):
+    filename = os.path.basename(original_file)
+    meta = await get_media_metadata(original_file)
+    decision = transcode_decision(meta)
+    duration_s = meta["duration_s"] if meta else 0.0
+    if duration_s <= 0:
+        duration_s = 1
+
+    transcoding_progress[filename] = {
+        "percent": 0.0,
+        "eta": 0.0,
+        "status": "in_progress",
+        "start_time": time.time(),
+        "duration_s": duration_s,
+    }
+    progress_broadcaster.publish(filename, force=True)
+
+    progressive = TRANSCODE_PROGRESSIVE
+    # Em partes não há HLS progressivo (as partes saem fora de ordem): com
+    # alguém esperando, vale mais começar a tocar em segundos do que
+    # terminar antes, então só jobs de background usam o modo em partes.
+    if decision == DECISION_FULL and use_chunked_transcode(duration_s) and (background or not progressive):
+        return await transcode_chunked(original_file, transcoded_path, meta, background)
+
+    # Escreve num arquivo temporário e só renomeia no fim: um MP4 parcial
+    # nunca aparece com o nome final (catálogo, /video e /download)
+    part_path = transcoded_path + ".part"
+    codec_args = transcode_codec_args(decision, meta)
+    # Mapeamento explícito: é a faixa que transcode_decision avaliou
+    stream_map = ["-map", "0:v:0", "-map", "0:a:0?"]
+    if progressive:
+        # Codifica uma vez só e o muxer tee grava o MP4 e um HLS "event",
+        # tocável enquanto o MP4 (faststart) ainda não ficou pronto. O MP4
+        # parcial usa a chave do título como nome: nomes de arquivo com
+        # caracteres especiais do tee ([ ] | :) quebrariam a sintaxe.
+        hls_dir = get_hls_dir(filename)
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        os.makedirs(hls_dir, exist_ok=True)
+        part_path = os.path.join(TRANSCODED_FOLDER, get_hls_key(filename) + ".mp4.part")
+        tee_outputs = "|".join([
+            f"[f=mp4:movflags=+faststart]{part_path}",
+            f"[f=hls:hls_time={HLS_SEGMENT_S}:hls_playlist_type=event:"
+            f"hls_segment_filename={os.path.join(hls_dir, 'seg_%05d.ts')}]"
+            f"{os.path.join(hls_dir, HLS_PLAYLIST)}",
+        ])
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i", original_file,
+            *stream_map,
+            *codec_args,
+            # Com tee, o MP4 precisa dos cabeçalhos do codec fora do fluxo
+            "-flags", "+global_header",
+            "-progress", "pipe:2",
+            "-nostats",
+            "-f", "tee",
+            tee_outputs,
+        ]
+    else:
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i", original_file,
+            *stream_map,
+            *codec_args,
+            "-movflags", "faststart",
+            "-progress", "pipe:2",
+            "-nostats",
+            "-f", "mp4",
+            part_path
+        ]
+    if background:
+        cmd = throttle_prefix() + cmd
+
+    print(f"[Transcode] Iniciando ({decision}): {original_file} -> {transcoded_path}")
+    returncode = await run_ffmpeg(cmd, lambda out_time_s: update_transcode_progress(filename, out_time_s))
+    if returncode != 0:
         print(f"[Transcode] Erro ao transcodificar {filename}")
         transcoding_progress[filename]["status"] = "error"
-        return
-
+        progress_broadcaster.publish(filename, force=True)
+        if progressive:
+            shutil.rmtree(get_hls_dir(filename), ignore_errors=True)
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        return False
+    os.replace(part_path, transcoded_path)
+
+    if progressive:
+        # Quem já está assistindo pelo HLS continua; novas visitas usam o MP4
+        schedule_hls_cleanup(filename)
+
+    await finish_transcode(original_file, transcoded_path)
+    return True
+
+async def finish_transcode(original_file: str, transcoded_path: str):
+    """
+    Marca a transcodificação como concluída e aplica a política de
+    retenção ao original.
+    """
+    filename = os.path.basename(original_file)
     transcoding_progress[filename]["percent"] = 100.0
     transcoding_progress[filename]["eta"] = 0.0
     transcoding_progress[filename]["status"] = "done"
+    progress_broadcaster.publish(filename, force=True)
 
-    try:
-        os.remove(original_file)
-        print(f"[Transcode] Arquivo original removido: {original_file}")
-    except Exception as e:
-        print(f"[Transcode] Erro ao remover {original_file}: {e}")
-
+    await run_db(clear_storage_eviction, filename)
+    await apply_source_retention(original_file, transcoded_path)
     print(f"[Transcode] Concluído: {transcoded_path}")
 
 async def ensure_transcoded(original_file: str) -> str:
+    """
+    Retorna o caminho a ser servido: o próprio original quando ele já toca
+    no navegador, senão o MP4 transcodificado (esperando a fila se preciso).
+    """
     filename = os.path.basename(original_file)
     transcoded_path = os.path.join(TRANSCODED_FOLDER, filename + ".mp4")
 
-    if filename in transcoding_tasks:
-        ttask = transcoding_tasks[filename]
-        if not ttask.done():
-            await ttask
-            return transcoded_path
-
     prog = transcoding_progress.get(filename, {})
     if prog.get("status") == "done" and os.path.isfile(transcoded_path):
         return transcoded_path
 
-    task = asyncio.create_task(transcode_file(original_file, transcoded_path))
-    transcoding_tasks[filename] = task
-    await task
+    if await get_transcode_decision(original_file) == DECISION_DIRECT:
+        return original_file
+
+    # Usuário esperando: entra (ou sobe) na fila com prioridade alta
+    await transcode_queue.enqueue(original_file, PRIORITY_USER)
     return transcoded_path
 
 #########################################
-# ENDPOINTS FASTAPI
+# METADADOS DE MÍDIA (FFPROBE EM CACHE)
 #########################################
 
-@video_app.get("/ads.txt", response_class=PlainTextResponse)
-def ads_txt():
-    return "google.com, pub-6682849033272336, DIRECT, f08c47fec0942fa0"
+# Cada arquivo é analisado pelo ffprobe uma única vez (por path+mtime+tamanho);
+# o resultado fica no SQLite e em memória para o transcodificador, o
+# catálogo e o player.
+PROBE_MAX_WORKERS = 2
+MEDIA_PROBE_SCAN_INTERVAL_S = 30
+
+# path -> registro (ver _parse_probe)
+media_metadata_cache = {}
+_probe_inflight = {}
+# path -> (mtime_ns, tamanho) de arquivos que o ffprobe não conseguiu ler
+_probe_failed = {}
+_probe_semaphore = None
+
+def init_media_metadata_db():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS media_metadata (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            duration_s REAL NOT NULL,
+            container TEXT,
+            video_codec TEXT,
+            width INTEGER,
+            height INTEGER,
+            bit_rate INTEGER,
+            audio_tracks TEXT NOT NULL,
+            subtitle_streams TEXT NOT NULL,
+            probed_at REAL NOT NULL,
+            pix_fmt TEXT
+        )
+        """)
+        # Bancos criados antes da coluna pix_fmt
+        c.execute("PRAGMA table_info(media_metadata)")
+        if "pix_fmt" not in [row[1] for row in c.fetchall()]:
+            c.execute("ALTER TABLE media_metadata ADD COLUMN pix_fmt TEXT")
+        conn.commit()
+
+def load_media_metadata():
+    """
+    Carrega todos os registros para a memória (um por arquivo da biblioteca).
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        SELECT path, mtime_ns, size, duration_s, container, video_codec, width,
+               height, bit_rate, audio_tracks, subtitle_streams, pix_fmt
+        FROM media_metadata
+        """)
+        for row in c.fetchall():
+            media_metadata_cache[row[0]] = {
+                "mtime_ns": row[1],
+                "size": row[2],
+                "duration_s": row[3],
+                "container": row[4],
+                "video_codec": row[5],
+                "width": row[6],
+                "height": row[7],
+                "bit_rate": row[8],
+                "audio_tracks": json.loads(row[9]),
+                "subtitle_streams": json.loads(row[10]),
+                "pix_fmt": row[11],
+            }
+
+def save_media_metadata(path: str, meta: dict):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        INSERT OR REPLACE INTO media_metadata
+            (path, mtime_ns, size, duration_s, container, video_codec, width,
+             height, bit_rate, audio_tracks, subtitle_streams, probed_at, pix_fmt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (path, meta["mtime_ns"], meta["size"], meta["duration_s"], meta["container"],
+              meta["video_codec"], meta["width"], meta["height"], meta["bit_rate"],
+              json.dumps(meta["audio_tracks"]), json.dumps(meta["subtitle_streams"]), time.time(),
+              meta["pix_fmt"]))
+        conn.commit()
+
+def delete_media_metadata(paths: list):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.executemany("DELETE FROM media_metadata WHERE path = ?", [(p,) for p in paths])
+        conn.commit()
+
+init_media_metadata_db()
+load_media_metadata()
+
+async def probe_media(file_path: str) -> dict:
+    """
+    Roda o ffprobe e retorna o JSON com 'format' e 'streams' ({} em caso de erro).
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "quiet",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        file_path
+    ]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        return json.loads(stdout.decode())
+    except Exception:
+        return {}
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_probe(info: dict, st: os.stat_result) -> dict:
+    fmt = info.get("format", {})
+    streams = info.get("streams", [])
+    video = next((s_ for s_ in streams if s_.get("codec_type") == "video"
+                  and not s_.get("disposition", {}).get("attached_pic")), None)
+    try:
+        duration_s = float(fmt.get("duration", 0) or 0)
+    except ValueError:
+        duration_s = 0.0
+    return {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "duration_s": duration_s,
+        "container": fmt.get("format_name"),
+        "video_codec": video.get("codec_name") if video else None,
+        "width": _int_or_none(video.get("width")) if video else None,
+        "height": _int_or_none(video.get("height")) if video else None,
+        "pix_fmt": video.get("pix_fmt") if video else None,
+        "bit_rate": _int_or_none(fmt.get("bit_rate")),
+        "audio_tracks": [
+            {
+                "codec": s_.get("codec_name"),
+                "channels": s_.get("channels"),
+                "language": s_.get("tags", {}).get("language"),
+            }
+            for s_ in streams if s_.get("codec_type") == "audio"
+        ],
+        "subtitle_streams": [
+            {
+                "codec": s_.get("codec_name"),
+                "language": s_.get("tags", {}).get("language"),
+            }
+            for s_ in streams if s_.get("codec_type") == "subtitle"
+        ],
+    }
+
+async def _probe_and_store(path: str, st: os.stat_result) -> dict | None:
+    global _probe_semaphore
+    if _probe_semaphore is None:
+        _probe_semaphore = asyncio.Semaphore(PROBE_MAX_WORKERS)
+    async with _probe_semaphore:
+        info = await probe_media(path)
+    if not info.get("format"):
+        _probe_failed[path] = (st.st_mtime_ns, st.st_size)
+        return None
+    _probe_failed.pop(path, None)
+    meta = _parse_probe(info, st)
+    media_metadata_cache[path] = meta
+    queue_db_write(save_media_metadata, path, meta)
+    return meta
+
+async def get_media_metadata(path: str) -> dict | None:
+    """
+    Metadados do arquivo, rodando o ffprobe só se o arquivo for novo ou tiver
+    mudado. Pedidos simultâneos para o mesmo arquivo compartilham o probe.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    meta = media_metadata_cache.get(path)
+    if meta and meta["mtime_ns"] == st.st_mtime_ns and meta["size"] == st.st_size:
+        return meta
+    if _probe_failed.get(path) == (st.st_mtime_ns, st.st_size):
+        return None
+    task = _probe_inflight.get(path)
+    if task is None:
+        task = asyncio.ensure_future(_probe_and_store(path, st))
+        _probe_inflight[path] = task
+        task.add_done_callback(lambda _t: _probe_inflight.pop(path, None))
+    return await asyncio.shield(task)
+
+def media_path_for(filename: str) -> str:
+    """
+    Arquivo que representa o título: o MP4 transcodificado, se existir.
+    """
+    if filename in catalog["transcodificados"]:
+        return os.path.join(TRANSCODED_FOLDER, filename + ".mp4")
+    return os.path.join(VIDEO_FOLDER, filename)
+
+def cached_media_metadata(filename: str) -> dict | None:
+    """
+    Metadados já conhecidos do título, sem stat nem ffprobe (para listagens).
+    """
+    return media_metadata_cache.get(media_path_for(filename))
+
+async def get_video_duration_s(file_path: str) -> float:
+    meta = await get_media_metadata(file_path)
+    return meta["duration_s"] if meta else 0.0
+
+async def media_probe_loop():
+    """
+    Analisa em segundo plano os arquivos do catálogo ainda sem metadados e
+    descarta os registros de arquivos que sumiram.
+    """
+    while True:
+        try:
+            with catalog_lock:
+                filmes = catalog["filmes"]
+            paths = [media_path_for(f) for f in filmes]
+            missing = [p for p in paths if p not in media_metadata_cache and p not in _probe_failed]
+            # Um arquivo por vez: o semáforo é por ordem de chegada, então o
+            # backfill ocupa no máximo um slot e o player, o transcodificador e
+            # a verificação de saídas esperam no máximo um ffprobe.
+            for p in missing:
+                await get_media_metadata(p)
+            gone = [p for p in media_metadata_cache if not os.path.exists(p)]
+            for p in gone:
+                del media_metadata_cache[p]
+            if gone:
+                queue_db_write(delete_media_metadata, gone)
+        except Exception as e:
+            print(f"[Metadados] Erro na varredura: {e}")
+        await asyncio.sleep(MEDIA_PROBE_SCAN_INTERVAL_S)
+
+def format_duration(seconds: float) -> str:
+    total_min = int(seconds // 60)
+    if total_min >= 60:
+        return f"{total_min // 60}h {total_min % 60:02d}min"
+    return f"{total_min}min"
+
+#########################################
+# DECISÃO DE TRANSCODIFICAÇÃO
+#########################################
+
+# O que os navegadores tocam num <video> sem ajuda
+BROWSER_VIDEO_CODECS = {"h264"}
+BROWSER_PIX_FMTS = {"yuv420p", "yuvj420p"}
+BROWSER_AUDIO_CODECS = {"aac", "mp3"}
+MP4_FORMAT_NAMES = {"mov", "mp4"}
+
+# Do mais barato para o mais caro
+DECISION_DIRECT = "direct"   # serve o original como está
+DECISION_REMUX = "remux"     # só troca o container para MP4
+DECISION_AUDIO = "audio"     # copia o vídeo e converte o áudio para AAC
+DECISION_FULL = "full"       # reencoda vídeo (H.264) e áudio
+
+def transcode_decision(meta: dict | None) -> str:
+    """
+    Escolhe o menor trabalho que deixa o arquivo tocável no navegador.
+    Sem metadados, mantém o comportamento antigo (copia vídeo, converte áudio).
+    """
+    if not meta or not meta["video_codec"]:
+        return DECISION_AUDIO
+    video_ok = (meta["video_codec"] in BROWSER_VIDEO_CODECS
+                and meta.get("pix_fmt") in BROWSER_PIX_FMTS | {None})
+    # Só a primeira faixa de áudio vai para o MP4 (os comandos usam
+    # -map 0:a:0; sem isso o ffmpeg escolheria a de mais canais)
+    tracks = meta["audio_tracks"]
+    audio_ok = not tracks or tracks[0]["codec"] in BROWSER_AUDIO_CODECS
+    container_ok = bool(MP4_FORMAT_NAMES & set((meta["container"] or "").split(",")))
+    if not video_ok:
+        return DECISION_FULL
+    if not audio_ok:
+        return DECISION_AUDIO
+    if not container_ok:
+        return DECISION_REMUX
+    return DECISION_DIRECT
+
+def transcode_codec_args(decision: str, meta: dict | None) -> list:
+    """
+    Argumentos de codec do ffmpeg para cada decisão (DIRECT vira REMUX,
+    para jobs que chegam à fila mesmo assim).
+    """
+    tracks = meta["audio_tracks"] if meta else []
+    audio_copy = bool(tracks) and tracks[0]["codec"] in BROWSER_AUDIO_CODECS
+    audio_args = ["-c:a", "copy"] if audio_copy else ["-c:a", "aac", "-b:a", "192k"]
+    if decision in (DECISION_DIRECT, DECISION_REMUX):
+        return ["-c:v", "copy", "-c:a", "copy"]
+    if decision == DECISION_FULL:
+        return ["-c:v", "libx264", "-preset", "veryfast", "-crf", "21",
+                "-pix_fmt", "yuv420p"] + audio_args
+    return ["-c:v", "copy", "-c:a", "aac", "-b:a", "192k"]
+
+async def get_transcode_decision(original_path: str) -> str:
+    return transcode_decision(await get_media_metadata(original_path))
+
+def cached_transcode_decision(filename: str) -> str | None:
+    """
+    Decisão para o título a partir do cache (None se ainda não analisado).
+    Títulos já transcodificados são sempre servidos direto.
+    """
+    if filename in catalog["transcodificados"]:
+        return DECISION_DIRECT
+    meta = media_metadata_cache.get(os.path.join(VIDEO_FOLDER, filename))
+    return transcode_decision(meta) if meta else None
+
+#########################################
+# TRANSCODIFICAÇÃO EM PARTES (PARALELA)
+#########################################
+
+# Modo opcional para reencodes completos de títulos longos: o vídeo é
+# cortado em partes nos keyframes (sem reencode), as partes são codificadas
+# em paralelo e depois juntadas com o concat demuxer (sem reencode). O
+# áudio é convertido uma vez só, inteiro, para não haver emendas audíveis.
+TRANSCODE_CHUNKED = os.getenv("TRANSCODE_CHUNKED", "0") == "1"
+CHUNK_MIN_DURATION_S = 600          # Abaixo disso não compensa dividir
+CHUNK_SEGMENT_S = 120
+CHUNK_THREADS = 2                   # Threads do x264 por parte
+CHUNK_MAX_PARALLEL = max(1, (os.cpu_count() or 2) // CHUNK_THREADS)
+CHUNKS_FOLDER = os.path.join(DATA_DIR, "chunks/")
+os.makedirs(CHUNKS_FOLDER, exist_ok=True)
+
+# Limita os ffmpeg de partes no processo inteiro (vários jobs dividem os núcleos)
+_chunk_semaphore = None
+
+def use_chunked_transcode(duration_s: float) -> bool:
+    return TRANSCODE_CHUNKED and duration_s >= CHUNK_MIN_DURATION_S
+
+def _read_segment_list(path: str) -> list:
+    """
+    Lê a lista CSV do muxer segment: [(arquivo, início, fim), ...].
+    """
+    chunks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().rsplit(",", 2)
+            if len(parts) == 3:
+                chunks.append((parts[0], float(parts[1]), float(parts[2])))
+    return chunks
+
+async def transcode_chunked(original_file: str, transcoded_path: str, meta: dict, background: bool) -> bool:
+    global _chunk_semaphore
+    if _chunk_semaphore is None:
+        _chunk_semaphore = asyncio.Semaphore(CHUNK_MAX_PARALLEL)
+    filename = os.path.basename(original_file)
+    work_dir = os.path.join(CHUNKS_FOLDER, get_hls_key(filename))
+    prefix = throttle_prefix() if background else []
+
+    try:
+        return await _transcode_chunked_steps(original_file, transcoded_path, meta, filename, work_dir, prefix)
+    except Exception:
+        # Erro inesperado (lista de partes ilegível, disco cheio...): não deixa
+        # a pasta de partes para trás. Cancelamento (desligamento) não cai
+        # aqui, então um job interrompido ainda pode ser retomado.
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+async def _transcode_chunked_steps(original_file: str, transcoded_path: str, meta: dict,
+                                   filename: str, work_dir: str, prefix: list) -> bool:
+    # Um job interrompido (queda do processo) continua de onde parou se o
+    # original não mudou: as partes prontas são reaproveitadas
+    st = os.stat(original_file)
+    stamp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "segment_s": CHUNK_SEGMENT_S}
+    stamp_path = os.path.join(work_dir, "source.json")
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            resumed = json.load(f) == stamp
+    except (OSError, ValueError):
+        resumed = False
+    if not resumed:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+    print(f"[Transcode] {'Retomando' if resumed else 'Iniciando'} em partes: {original_file} -> {transcoded_path}")
+
+    def fail(step: str) -> bool:
+        print(f"[Transcode] Erro ao transcodificar {filename} ({step})")
+        transcoding_progress[filename]["status"] = "error"
+        progress_broadcaster.publish(filename, force=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return False
+
+    # 1) Corta só o vídeo em partes alinhadas aos keyframes
+    segment_list = os.path.join(work_dir, "parts.csv")
+    split_cmd = prefix + [
+        "ffmpeg", "-y",
+        "-nostats", "-loglevel", "error",
+        "-i", original_file,
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(CHUNK_SEGMENT_S),
+        "-segment_list", segment_list,
+        "-segment_list_type", "csv",
+        "-reset_timestamps", "1",
+        os.path.join(work_dir, "src_%05d.mkv"),
+    ]
+    if not resumed:
+        if await run_ffmpeg(split_cmd) != 0:
+            return fail("divisão")
+        # source.json marca a divisão como completa
+        with open(stamp_path, "w", encoding="utf-8") as f:
+            json.dump(stamp, f)
+    chunks = _read_segment_list(segment_list)
+    if not chunks:
+        return fail("divisão")
+
+    # 2) Codifica as partes em paralelo; o progresso é a soma das partes
+    done_s = [0.0] * len(chunks)
+    codec_args = transcode_codec_args(DECISION_FULL, meta)
+    video_args = codec_args[:codec_args.index("-c:a")]
+
+    async def encode_part(i: int, name: str) -> bool:
+        def on_out_time(out_time_s: float):
+            done_s[i] = out_time_s
+            update_transcode_progress(filename, sum(done_s))
+
+        output = os.path.join(work_dir, f"enc_{i:05d}.mkv")
+        if not os.path.isfile(output):
+            async with _chunk_semaphore:
+                cmd = prefix + [
+                    "ffmpeg", "-y",
+                    "-i", os.path.join(work_dir, name),
+                    *video_args,
+                    "-threads", str(CHUNK_THREADS),
+                    "-an",
+                    "-progress", "pipe:2",
+                    "-nostats",
+                    "-f", "matroska",
+                    output + ".part",
+                ]
+                if await run_ffmpeg(cmd, on_out_time) != 0:
+                    return False
+            os.replace(output + ".part", output)
+        done_s[i] = chunks[i][2] - chunks[i][1]
+        update_transcode_progress(filename, sum(done_s))
+        return True
+
+    async def encode_audio() -> bool:
+        output = os.path.join(work_dir, "audio.mka")
+        if not meta["audio_tracks"] or os.path.isfile(output):
+            return True
+        async with _chunk_semaphore:
+            cmd = prefix + [
+                "ffmpeg", "-y",
+                "-i", original_file,
+                "-map", "0:a:0",
+                *codec_args[codec_args.index("-c:a"):],
+                "-nostats", "-loglevel", "error",
+                "-f", "matroska",
+                output + ".part",
+            ]
+            if await run_ffmpeg(cmd) != 0:
+                return False
+        os.replace(output + ".part", output)
+        return True
+
+    results = await asyncio.gather(encode_audio(), *(encode_part(i, c[0]) for i, c in enumerate(chunks)))
+    if not all(results):
+        return fail("partes")
+
+    # 3) Junta as partes e o áudio sem reencode
+    concat_list = os.path.join(work_dir, "concat.txt")
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for i in range(len(chunks)):
+            f.write(f"file 'enc_{i:05d}.mkv'\n")
+    join_cmd = prefix + [
+        "ffmpeg", "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", concat_list,
+    ]
+    if meta["audio_tracks"]:
+        join_cmd += ["-i", os.path.join(work_dir, "audio.mka"), "-map", "0:v:0", "-map", "1:a:0"]
+    part_path = transcoded_path + ".part"
+    join_cmd += [
+        "-c", "copy",
+        "-movflags", "faststart",
+        "-nostats", "-loglevel", "error",
+        "-f", "mp4",
+        part_path,
+    ]
+    if await run_ffmpeg(join_cmd) != 0:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        return fail("junção")
+    os.replace(part_path, transcoded_path)
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    await finish_transcode(original_file, transcoded_path)
+    return True
+
+#########################################
+# SAÍDA HLS PROGRESSIVA
+#########################################
+
+# Com o modo progressivo, transcode_file também gera um HLS "event" que o
+# player usa enquanto o MP4 (faststart) ainda não ficou pronto.
+TRANSCODE_PROGRESSIVE = os.getenv("TRANSCODE_PROGRESSIVE", "1") == "1"
+HLS_SEGMENT_S = 6
+HLS_PLAYLIST = "index.m3u8"
+# Tempo que os segmentos ficam no disco depois que o MP4 final fica pronto
+HLS_RETENTION_S = 4 * 3600
+
+HLS_FILE_RE = re.compile(r"^(index\.m3u8|seg_\d{5}\.ts)$")
+
+def get_hls_key(filename: str) -> str:
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+
+def get_hls_dir(filename: str) -> str:
+    return os.path.join(HLS_FOLDER, get_hls_key(filename))
+
+def hls_playable(filename: str) -> bool:
+    """
+    O playlist só é escrito depois que o primeiro segmento fica completo.
+    """
+    return os.path.isfile(os.path.join(get_hls_dir(filename), HLS_PLAYLIST))
+
+def schedule_hls_cleanup(filename: str, delay_s: float = HLS_RETENTION_S):
+    hls_dir = get_hls_dir(filename)
+    asyncio.get_running_loop().call_later(
+        delay_s, lambda: shutil.rmtree(hls_dir, ignore_errors=True)
+    )
+
+def purge_stale_hls():
+    """
+    Na inicialização nenhuma transcodificação está rodando e os jobs
+    restaurados recomeçam do zero, então todos os diretórios HLS são velhos.
+    """
+    try:
+        entries = os.listdir(HLS_FOLDER)
+    except OSError:
+        return
+    for entry in entries:
+        shutil.rmtree(os.path.join(HLS_FOLDER, entry), ignore_errors=True)
+
+#########################################
+# FILA DE TRANSCODIFICAÇÃO
+#########################################
+
+# Quantos ffmpeg podem rodar ao mesmo tempo
+TRANSCODE_MAX_WORKERS = int(os.getenv("TRANSCODE_MAX_WORKERS", "2"))
+
+# Menor valor = atendido primeiro
+PRIORITY_USER = 0          # alguém está esperando na página de progresso
+PRIORITY_BACKGROUND = 10   # pré-transcodificação sem ninguém esperando
+
+# Jobs de background só rodam sem job de usuário em execução, um por vez,
+# e com prioridade mínima de CPU/IO (nice/ionice)
+BACKGROUND_MAX_WORKERS = 1
+
+def throttle_prefix() -> list:
+    prefix = []
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    return prefix
+
+def init_transcode_jobs_db():
+    """
+    Cria a tabela 'transcode_jobs', onde a fila é persistida para
+    sobreviver a reinícios.
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS transcode_jobs (
+            filename TEXT PRIMARY KEY,
+            original_path TEXT NOT NULL,
+            transcoded_path TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """)
+        conn.commit()
+
+def save_transcode_job(job: dict):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        INSERT OR REPLACE INTO transcode_jobs
+            (filename, original_path, transcoded_path, priority, status,
+             attempts, enqueued_at, started_at, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (job["filename"], job["original_path"], job["transcoded_path"],
+              job["priority"], job["status"], job["attempts"], job["enqueued_at"],
+              job["started_at"], job["finished_at"]))
+        conn.commit()
+
+def load_unfinished_transcode_jobs() -> list:
+    """
+    Retorna os jobs pendentes e os que estavam rodando quando o processo
+    parou (esses voltam para a fila), na ordem em que foram enfileirados.
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        SELECT filename, original_path, transcoded_path, priority, attempts, enqueued_at
+        FROM transcode_jobs
+        WHERE status IN ('pending', 'running')
+        ORDER BY enqueued_at
+        """)
+        return [
+            {
+                "filename": row[0],
+                "original_path": row[1],
+                "transcoded_path": row[2],
+                "priority": row[3],
+                "attempts": row[4],
+                "enqueued_at": row[5],
+            }
+            for row in c.fetchall()
+        ]
+
+init_transcode_jobs_db()
+
+# Um job que derruba o processo várias vezes não volta para a fila no boot
+TRANSCODE_MAX_ATTEMPTS = 3
+
+def cleanup_interrupted_transcodes(unfinished: list):
+    """
+    No boot, apaga os MP4 parciais (.part) e os diretórios de partes que
+    não pertencem a nenhum job que ainda vai rodar.
+    """
+    try:
+        with os.scandir(TRANSCODED_FOLDER) as it:
+            for entry in it:
+                if entry.name.endswith(".part"):
+                    print(f"[Fila] Removendo saída parcial: {entry.name}")
+                    os.remove(entry.path)
+    except OSError:
+        pass
+    keep = {get_hls_key(row["filename"]) for row in unfinished}
+    try:
+        entries = os.listdir(CHUNKS_FOLDER)
+    except OSError:
+        return
+    for entry in entries:
+        if entry not in keep:
+            shutil.rmtree(os.path.join(CHUNKS_FOLDER, entry), ignore_errors=True)
+
+class TranscodeQueue:
+    """
+    Fila de prioridade de transcodificação com no máximo 'max_workers'
+    ffmpeg simultâneos. Pedidos repetidos do mesmo arquivo são
+    deduplicados (um pedido de usuário promove um job de background).
+    Roda no event loop do servidor FastAPI.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.jobs = {}          # filename -> job pendente ou em execução
+        self.loop = None
+        self._heap = []         # (priority, seq, filename); entradas velhas são ignoradas
+        self._seq = itertools.count()
+        self._cond = None
+        self._workers = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._cond = asyncio.Condition()
+        rows = await run_db(load_unfinished_transcode_jobs)
+        cleanup_interrupted_transcodes(rows)
+        for row in rows:
+            if os.path.isfile(row["transcoded_path"]):
+                # O MP4 final só existe depois do rename atômico: o job terminou
+                # e o processo caiu antes de registrar (e o original pode já ter
+                # saído pela política de retenção)
+                self._mark_finished(row, "done")
+                continue
+            if not os.path.isfile(row["original_path"]):
+                print(f"[Fila] Original sumiu, descartando job: {row['filename']}")
+                self._mark_finished(row, "error")
+                continue
+            if row["attempts"] >= TRANSCODE_MAX_ATTEMPTS:
+                print(f"[Fila] Job interrompido {row['attempts']} vez(es), desistindo: {row['filename']}")
+                self._mark_finished(row, "error")
+                continue
+            self._add_job(row["original_path"], row["priority"], row["enqueued_at"], row["attempts"])
+        if self.jobs:
+            print(f"[Fila] {len(self.jobs)} job(s) restaurado(s) do banco.")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def _mark_finished(self, row: dict, status: str):
+        queue_db_write(save_transcode_job, {**row, "status": status, "started_at": None, "finished_at": time.time()})
+
+    def _add_job(self, original_file: str, priority: int, enqueued_at: float, attempts: int = 0) -> dict:
+        filename = os.path.basename(original_file)
+        job = {
+            "filename": filename,
+            "original_path": original_file,
+            "transcoded_path": os.path.join(TRANSCODED_FOLDER, filename + ".mp4"),
+            "priority": priority,
+            "status": "pending",
+            "attempts": attempts,
+            "enqueued_at": enqueued_at,
+            "started_at": None,
+            "finished_at": None,
+            "seq": next(self._seq),
+            "future": self.loop.create_future(),
+        }
+        self.jobs[filename] = job
+        heapq.heappush(self._heap, (priority, job["seq"], filename))
+        queue_db_write(save_transcode_job, dict(job))
+        transcoding_progress[filename] = {
+            "percent": 0.0,
+            "eta": 0.0,
+            "status": "queued",
+            "start_time": time.time(),
+            "duration_s": 0.0,
+        }
+        progress_broadcaster.publish(filename, force=True)
+        return job
+
+    async def enqueue(self, original_file: str, priority: int) -> bool:
+        """
+        Enfileira (ou reaproveita) o job do arquivo e espera terminar.
+        Retorna True se a transcodificação deu certo.
+        """
+        return await self.submit(original_file, priority)
+
+    def submit(self, original_file: str, priority: int) -> asyncio.Future:
+        """
+        Enfileira (ou reaproveita) o job do arquivo sem esperar. Retorna o
+        future que resolve com True/False ao fim da transcodificação.
+        """
+        filename = os.path.basename(original_file)
+        job = self.jobs.get(filename)
+        if job is None:
+            job = self._add_job(original_file, priority, time.time())
+        elif job["status"] == "pending" and priority < job["priority"]:
+            job["priority"] = priority
+            heapq.heappush(self._heap, (priority, job["seq"], filename))
+            queue_db_write(save_transcode_job, dict(job))
+        else:
+            return job["future"]
+        self.loop.create_task(self._notify())
+        return job["future"]
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify()
+
+    def position(self, filename: str):
+        """
+        Posição (1 = próximo) do arquivo entre os jobs pendentes, ou None.
+        """
+        job = self.jobs.get(filename)
+        if job is None or job["status"] != "pending":
+            return None
+        key = (job["priority"], job["seq"])
+        ahead = sum(
+            1 for other in self.jobs.values()
+            if other["status"] == "pending" and (other["priority"], other["seq"]) < key
+        )
+        return ahead + 1
+
+    def _background_allowed(self) -> bool:
+        running = [j for j in self.jobs.values() if j["status"] == "running"]
+        if any(j["priority"] < PRIORITY_BACKGROUND for j in running):
+            return False
+        return len(running) < BACKGROUND_MAX_WORKERS
+
+    def _pop(self):
+        while self._heap:
+            priority, seq, filename = self._heap[0]
+            job = self.jobs.get(filename)
+            if not (job and job["status"] == "pending" and job["priority"] == priority and job["seq"] == seq):
+                heapq.heappop(self._heap)
+                continue
+            if priority >= PRIORITY_BACKGROUND and not self._background_allowed():
+                return None
+            heapq.heappop(self._heap)
+            return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._cond:
+                job = self._pop()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._pop()
+                job["status"] = "running"
+
+            filename = job["filename"]
+            transcoding_progress[filename]["status"] = "in_progress"
+            # Quem continua na fila andou uma posição
+            for other in list(self.jobs):
+                progress_broadcaster.publish(other)
+            job["started_at"] = time.time()
+            job["attempts"] += 1
+            queue_db_write(save_transcode_job, dict(job))
+            try:
+                background = job["priority"] >= PRIORITY_BACKGROUND
+                ok = await transcode_file(job["original_path"], job["transcoded_path"], background=background)
+            except Exception as e:
+                print(f"[Fila] Erro inesperado ao transcodificar {filename}: {e}")
+                transcoding_progress.setdefault(filename, {})["status"] = "error"
+                # Sem isso os assinantes do SSE ficariam presos em "in_progress"
+                progress_broadcaster.publish(filename, force=True)
+                ok = False
+
+            job["status"] = "done" if ok else "error"
+            job["finished_at"] = time.time()
+            queue_db_write(save_transcode_job, dict(job))
+            del self.jobs[filename]
+            if not job["future"].done():
+                job["future"].set_result(ok)
+            # Um job a menos pode liberar jobs de background em espera
+            async with self._cond:
+                self._cond.notify_all()
+
+transcode_queue = TranscodeQueue(TRANSCODE_MAX_WORKERS)
+
+#########################################
+# OBSERVADOR DE PASTAS (INOTIFY + POLLING)
+#########################################
+
+# Intervalo do fallback por polling (mtime das pastas). Também cobre storage
+# de rede, onde o inotify não recebe eventos de alterações feitas remotamente.
+FOLDER_POLL_INTERVAL_S = 30.0
+
+# Constantes do inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+def _load_inotify():
+    """
+    Carrega inotify_init1/inotify_add_watch da libc via ctypes.
+    Retorna None se não estiver disponível (ex.: fora do Linux).
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class FolderWatcher:
+    """
+    Observa pastas e avisa os callbacks registrados quando arquivos aparecem
+    ou somem. Cada callback recebe (evento, nome), onde evento é "add",
+    "remove" ou "rescan" (nome=None: o callback deve reler a pasta inteira).
+    """
+
+    def __init__(self, poll_interval_s: float):
+        self.poll_interval_s = poll_interval_s
+        self.inotify_active = False
+        self._listeners = {}     # pasta -> [callbacks]
+        self._mtimes = {}        # pasta -> último mtime visto
+        self._wd_to_folder = {}
+        self._fd = None
+        self._thread = None
+
+    def watch(self, folder: str, callback):
+        self._listeners.setdefault(folder, []).append(callback)
+
+    def start(self):
+        """
+        Registra os watches, faz a leitura inicial (síncrona) de todas as
+        pastas e inicia a thread de observação.
+        """
+        if self._thread is not None:
+            return
+        self._setup_inotify()
+        for folder in self._listeners:
+            self._mtimes[folder] = self._folder_mtime(folder)
+            self._dispatch(folder, "rescan", None)
+        self._thread = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._thread.start()
+
+    def _setup_inotify(self):
+        libc = _load_inotify()
+        if libc is None:
+            print("[Watcher] inotify indisponível, usando apenas polling.")
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            print(f"[Watcher] inotify_init1 falhou (errno {ctypes.get_errno()}), usando apenas polling.")
+            return
+        mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        for folder in self._listeners:
+            wd = libc.inotify_add_watch(fd, os.fsencode(folder), mask)
+            if wd < 0:
+                print(f"[Watcher] Não foi possível observar {folder} (errno {ctypes.get_errno()}).")
+                continue
+            self._wd_to_folder[wd] = folder
+        self._fd = fd
+        self.inotify_active = bool(self._wd_to_folder)
+
+    @staticmethod
+    def _folder_mtime(folder: str):
+        try:
+            return os.stat(folder).st_mtime_ns
+        except OSError:
+            return None
+
+    def _dispatch(self, folder: str, event: str, name):
+        for callback in self._listeners.get(folder, []):
+            try:
+                callback(event, name)
+            except Exception as e:
+                print(f"[Watcher] Erro ao processar evento {event} em {folder}: {e}")
+
+    def _run(self):
+        while True:
+            if self._fd is not None:
+                try:
+                    ready, _, _ = select.select([self._fd], [], [], self.poll_interval_s)
+                except OSError:
+                    ready = []
+                if ready:
+                    self._read_inotify_events()
+                    continue
+            else:
+                time.sleep(self.poll_interval_s)
+            self._poll_mtimes()
+
+    def _read_inotify_events(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(buf):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += INOTIFY_EVENT.size
+            raw_name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                for folder in self._listeners:
+                    self._dispatch(folder, "rescan", None)
+                continue
+            folder = self._wd_to_folder.get(wd)
+            if folder is None or mask & IN_ISDIR or not raw_name:
+                continue
+            name = os.fsdecode(raw_name)
+            if mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._dispatch(folder, "add", name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._dispatch(folder, "remove", name)
+
+    def _poll_mtimes(self):
+        for folder in self._listeners:
+            mtime = self._folder_mtime(folder)
+            if mtime != self._mtimes.get(folder):
+                self._mtimes[folder] = mtime
+                self._dispatch(folder, "rescan", None)
+
+folder_watcher = FolderWatcher(FOLDER_POLL_INTERVAL_S)
+
+#########################################
+# ÍNDICE DO CATÁLOGO EM MEMÓRIA
+#########################################
+
+SUPPORTED_EXTS = (".mp4", ".mkv", ".avi", ".mov", ".flv")
+
+# 'filmes' é sempre substituída (nunca alterada no lugar), então quem lê
+# pode usar a referência sem segurar o lock. 'originais' e 'transcodificados'
+# mapeiam nome do filme -> mtime do arquivo (usado na ordenação "recentes").
+catalog_lock = threading.Lock()
+catalog = {
+    "originais": {},
+    "transcodificados": {},
+    "filmes": [],
+    "version": 0,
+}
+
+# Callbacks chamados com (adicionados, removidos) quando a lista visível muda
+catalog_listeners = []
+
+def _original_name(name: str):
+    return name if name.lower().endswith(SUPPORTED_EXTS) else None
+
+def _transcoded_name(name: str):
+    if name.lower().endswith(".mp4"):
+        return os.path.splitext(name)[0]
+    return None
+
+def _scan_folder(folder: str, parse) -> dict:
+    found = {}
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                parsed = parse(entry.name)
+                if parsed is None:
+                    continue
+                try:
+                    found[parsed] = entry.stat().st_mtime
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"[Catálogo] Erro ao ler {folder}: {e}")
+    return found
+
+def _apply_catalog_event(key: str, folder: str, parse, event: str, name):
+    """
+    Atualiza o mapa 'key' do catálogo e, se algo visível mudar (lista ou
+    mtime), publica uma nova lista ordenada e incrementa a versão.
+    """
+    if event == "rescan":
+        fresh = _scan_folder(folder, parse)
+    else:
+        parsed = parse(name)
+        if parsed is None:
+            return
+        mtime = None
+        if event == "add":
+            try:
+                mtime = os.stat(os.path.join(folder, name)).st_mtime
+            except OSError:
+                return
+    added, removed = (), ()
+    with catalog_lock:
+        source = catalog[key]
+        if event == "rescan":
+            if fresh == source:
+                return
+            catalog[key] = fresh
+            visible = catalog["originais"].keys() | catalog["transcodificados"].keys()
+            previous = set(catalog["filmes"])
+            added = visible - previous
+            removed = previous - visible
+            filmes = sorted(visible)
+        else:
+            if event == "add":
+                if source.get(parsed) == mtime:
+                    return
+                source[parsed] = mtime
+            elif event == "remove":
+                if parsed not in source:
+                    return
+                del source[parsed]
+            visible_now = parsed in catalog["originais"] or parsed in catalog["transcodificados"]
+            filmes = catalog["filmes"]
+            idx = bisect.bisect_left(filmes, parsed)
+            listed = idx < len(filmes) and filmes[idx] == parsed
+            if visible_now != listed:
+                filmes = list(filmes)
+                if visible_now:
+                    filmes.insert(idx, parsed)
+                    added = (parsed,)
+                else:
+                    del filmes[idx]
+                    removed = (parsed,)
+        catalog["filmes"] = filmes
+        catalog["version"] += 1
+
+    if added or removed:
+        for listener in catalog_listeners:
+            try:
+                listener(added, removed)
+            except Exception as e:
+                print(f"[Catálogo] Erro ao notificar mudança: {e}")
+
+def _on_video_folder_event(event: str, name):
+    _apply_catalog_event("originais", VIDEO_FOLDER, _original_name, event, name)
+
+def _on_transcoded_folder_event(event: str, name):
+    _apply_catalog_event("transcodificados", TRANSCODED_FOLDER, _transcoded_name, event, name)
+
+folder_watcher.watch(VIDEO_FOLDER, _on_video_folder_event)
+folder_watcher.watch(TRANSCODED_FOLDER, _on_transcoded_folder_event)
+
+#########################################
+# PAGINAÇÃO DO CATÁLOGO (API JSON)
+#########################################
+
+CATALOG_PAGE_SIZE = 48
+CATALOG_MAX_PAGE_SIZE = 200
+CATALOG_SORTS = ("nome", "-nome", "recentes")
+
+# Visões derivadas do catálogo, recalculadas uma vez por versão
+catalog_views_lock = threading.Lock()
+catalog_views = {"version": None}
+
+def get_catalog_views() -> dict:
+    """
+    Retorna as visões ordenadas da versão atual do catálogo:
+    'nome' (lista ordenada), 'recentes' (lista de chaves (-mtime, nome))
+    e 'titulos' (nome -> título em minúsculas, para a busca por substring).
+    """
+    global catalog_views
+    views = catalog_views
+    if views["version"] == catalog["version"]:
+        return views
+    with catalog_views_lock:
+        if catalog_views["version"] == catalog["version"]:
+            return catalog_views
+        with catalog_lock:
+            version = catalog["version"]
+            filmes = catalog["filmes"]
+            originais = dict(catalog["originais"])
+            transcodificados = dict(catalog["transcodificados"])
+        recentes = sorted(
+            (-max(originais.get(f, 0.0), transcodificados.get(f, 0.0)), f)
+            for f in filmes
+        )
+        views = {
+            "version": version,
+            "nome": filmes,
+            "recentes": recentes,
+            "titulos": {f: format_title(f).lower() for f in filmes},
+        }
+        catalog_views = views
+        return views
+
+def encode_catalog_cursor(sort: str, key) -> str:
+    raw = json.dumps([sort, key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_catalog_cursor(cursor: str, sort: str):
+    """
+    Decodifica um cursor gerado por encode_catalog_cursor. Levanta
+    HTTPException(400) se o cursor for inválido ou de outra ordenação.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+        if cursor_sort != sort:
+            raise HTTPException(status_code=400, detail="Cursor de outra ordenação")
+        if sort == "recentes":
+            mtime, name = key
+            if isinstance(mtime, bool) or not isinstance(mtime, (int, float)) or not isinstance(name, str):
+                raise ValueError("chave de cursor inválida")
+            return (float(mtime), name)
+        if not isinstance(key, str):
+            raise ValueError("chave de cursor inválida")
+        return key
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def catalog_page(sort: str, cursor: str | None, limit: int, q: str | None, prefix: str | None):
+    """
+    Retorna (nomes da página, próximo cursor ou None, total filtrado).
+    Os cursores carregam a chave do último item, então continuam válidos
+    mesmo que filmes sejam adicionados ou removidos entre as páginas.
+    """
+    views = get_catalog_views()
+    nomes = views["nome"]
+
+    # Filtro por prefixo do nome do arquivo: faixa contígua na lista ordenada
+    if prefix:
+        lo = bisect.bisect_left(nomes, prefix)
+        hi = bisect.bisect_left(nomes, prefix + "\U0010ffff")
+        nomes = nomes[lo:hi]
+
+    if sort == "recentes":
+        keys = views["recentes"]
+        if prefix:
+            keys = [k for k in keys if k[1].startswith(prefix)]
+    else:
+        keys = nomes
+
+    if q:
+        needle = q.strip().lower()
+        titulos = views["titulos"]
+        if sort == "recentes":
+            keys = [k for k in keys if needle in titulos[k[1]]]
+        else:
+            keys = [k for k in keys if needle in titulos[k]]
+
+    total = len(keys)
+    after = decode_catalog_cursor(cursor, sort) if cursor else None
+
+    if sort == "-nome":
+        end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+        start = max(0, end - limit)
+        page = keys[start:end][::-1]
+        has_more = start > 0
+    else:
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        page = keys[start:start + limit]
+        has_more = start + limit < len(keys)
+
+    next_cursor = None
+    if page and has_more:
+        last = page[-1]
+        next_cursor = encode_catalog_cursor(sort, list(last) if sort == "recentes" else last)
+    if sort == "recentes":
+        page = [k[1] for k in page]
+    return page, next_cursor, total
+
+def catalog_item(filename: str, server_url: str) -> dict:
+    return {
+        "filename": filename,
+        "titulo": format_title(filename),
+        "capa": get_cover_image(filename),
+        "link": f"{server_url}/filmes?filename={filename}",
+        **media_summary(cached_media_metadata(filename)),
+        "reproducao": cached_transcode_decision(filename),
+    }
+
+def media_summary(meta: dict | None) -> dict:
+    """
+    Campos resumidos dos metadados para a API (vazios se ainda não analisado).
+    """
+    if not meta:
+        return {"duracao": None, "resolucao": None, "audios": [], "legendas_embutidas": 0}
+    return {
+        "duracao": meta["duration_s"],
+        "resolucao": f"{meta['height']}p" if meta["height"] else None,
+        "audios": [t["language"] or t["codec"] for t in meta["audio_tracks"]],
+        "legendas_embutidas": len(meta["subtitle_streams"]),
+    }
+
+#########################################
+# ÍNDICE DE BUSCA POR TÍTULO
+#########################################
+
+SEARCH_MAX_RESULTS = 50
+
+# token -> conjunto de filmes; 'tokens' é a lista ordenada de tokens,
+# usada para resolver buscas por prefixo com bisect.
+search_lock = threading.Lock()
+search_index = {"postings": {}, "tokens": [], "docs": {}}
+
+def fold_text(text: str) -> str:
+    """
+    Remove acentos e converte para minúsculas ("Ação" -> "acao").
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def tokenize_title(text: str) -> list:
+    return re.findall(r"[0-9a-z]+", fold_text(text))
+
+def _index_filme(filename: str):
+    tokens = set(tokenize_title(format_title(filename)))
+    search_index["docs"][filename] = tokens
+    postings = search_index["postings"]
+    for token in tokens:
+        docs = postings.get(token)
+        if docs is None:
+            postings[token] = {filename}
+            bisect.insort(search_index["tokens"], token)
+        else:
+            docs.add(filename)
+
+def _unindex_filme(filename: str):
+    tokens = search_index["docs"].pop(filename, ())
+    postings = search_index["postings"]
+    for token in tokens:
+        docs = postings.get(token)
+        if docs is None:
+            continue
+        docs.discard(filename)
+        if not docs:
+            del postings[token]
+            idx = bisect.bisect_left(search_index["tokens"], token)
+            if idx < len(search_index["tokens"]) and search_index["tokens"][idx] == token:
+                del search_index["tokens"][idx]
+
+def _on_catalog_change_search(added, removed):
+    with search_lock:
+        for filename in removed:
+            _unindex_filme(filename)
+        for filename in added:
+            _index_filme(filename)
+
+catalog_listeners.append(_on_catalog_change_search)
+
+def search_titles(query: str, limit: int = SEARCH_MAX_RESULTS):
+    """
+    Busca filmes cujo título contenha todos os termos da consulta, cada termo
+    casando como prefixo de uma palavra do título (sem acentos, sem caixa).
+    Retorna (filmes, total), com os casamentos exatos de palavra primeiro.
+    """
+    terms = sorted(set(tokenize_title(query)), key=len, reverse=True)
+    if not terms:
+        return [], 0
+    with search_lock:
+        postings = search_index["postings"]
+        tokens = search_index["tokens"]
+        result = None
+        exact_hits = {}
+        for term in terms:
+            matches = set()
+            lo = bisect.bisect_left(tokens, term)
+            for i in range(lo, len(tokens)):
+                token = tokens[i]
+                if not token.startswith(term):
+                    break
+                docs = postings[token]
+                if result is not None:
+                    docs = docs & result
+                matches |= docs
+                if token == term:
+                    for doc in docs:
+                        exact_hits[doc] = exact_hits.get(doc, 0) + 1
+            result = matches
+            if not result:
+                return [], 0
+    ranked = heapq.nsmallest(limit, result, key=lambda f: (-exact_hits.get(f, 0), f))
+    return ranked, len(result)
+
+#########################################
+# MAPA DE CAPAS E LEGENDAS EM MEMÓRIA
+#########################################
+
+COVER_EXTS = (".jpg", ".jpeg", ".png", ".webp")     # em ordem de preferência
+SUBTITLE_EXTS = (".vtt", ".srt")
+
+# nome base do filme -> arquivo da capa/legenda escolhido
+asset_lock = threading.Lock()
+asset_files = {"capas": set(), "legendas": set()}
+asset_maps = {"capas": {}, "legendas": {}}
+asset_stats = {
+    "cover_hits": 0,
+    "cover_misses": 0,
+    "subtitle_hits": 0,
+    "subtitle_misses": 0,
+    "version": 0,
+}
+
+def _resolve_asset(files: set, base: str, exts: tuple):
+    for ext in exts:
+        if base + ext in files:
+            return base + ext
+    return None
+
+def _apply_asset_event(key: str, folder: str, exts: tuple, event: str, name):
+    """
+    Mantém o mapa nome base -> arquivo da pasta 'folder', respeitando a
+    ordem de preferência das extensões.
+    """
+    if event == "rescan":
+        files = set()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.endswith(exts):
+                        files.add(entry.name)
+        except OSError as e:
+            print(f"[Assets] Erro ao ler {folder}: {e}")
+        mapping = {}
+        for f in files:
+            base = os.path.splitext(f)[0]
+            if base not in mapping:
+                mapping[base] = _resolve_asset(files, base, exts)
+        with asset_lock:
+            if mapping != asset_maps[key]:
+                asset_stats["version"] += 1
+            asset_files[key] = files
+            asset_maps[key] = mapping
+        return
+
+    if not name.endswith(exts):
+        return
+    base = os.path.splitext(name)[0]
+    with asset_lock:
+        files = asset_files[key]
+        if event == "add":
+            files.add(name)
+        elif event == "remove":
+            files.discard(name)
+        resolved = _resolve_asset(files, base, exts)
+        mapping = asset_maps[key]
+        if mapping.get(base) == resolved:
+            return
+        if resolved is None:
+            mapping.pop(base, None)
+        else:
+            mapping[base] = resolved
+        asset_stats["version"] += 1
+
+def _on_imagens_folder_event(event: str, name):
+    _apply_asset_event("capas", IMAGENS_FOLDER, COVER_EXTS, event, name)
+
+def _on_legendas_folder_event(event: str, name):
+    _apply_asset_event("legendas", LEGENDAS_FOLDER, SUBTITLE_EXTS, event, name)
+
+folder_watcher.watch(IMAGENS_FOLDER, _on_imagens_folder_event)
+folder_watcher.watch(LEGENDAS_FOLDER, _on_legendas_folder_event)
+
+#########################################
+# GERENCIADOR DE ARMAZENAMENTO
+#########################################
+
+# O que fazer com o original depois de uma transcodificação bem-sucedida:
+#   keep            - mantém em VIDEO_FOLDER (permite retranscodificar depois)
+#   cold            - move para COLD_FOLDER (outro disco/volume mais barato)
+#   delete_verified - apaga, mas só se o MP4 gerado passar na verificação
+# O padrão é "delete_verified", que é o comportamento de sempre (o original
+# saía depois da transcodificação). Só com "keep" os MP4 podem ser
+# despejados por falta de espaço: com "cold" e "delete_verified" o MP4 é a
+# única cópia tocável do título, então o despejo não libera nada deles.
+SOURCE_RETENTION = os.getenv("SOURCE_RETENTION", "delete_verified")
+SOURCE_RETENTION_POLICIES = ("keep", "cold", "delete_verified")
+if SOURCE_RETENTION not in SOURCE_RETENTION_POLICIES:
+    print(f"[Storage] Política de retenção inválida '{SOURCE_RETENTION}', usando 'keep'")
+    SOURCE_RETENTION = "keep"
+
+# Diferença de duração aceita entre original e MP4 na verificação
+VERIFY_DURATION_TOLERANCE_S = 2.0
+VERIFY_DURATION_TOLERANCE_RATIO = 0.01
+
+# Uso do disco de TRANSCODED_FOLDER: acima de HIGH, apaga os MP4 menos
+# assistidos que podem ser regerados (original ainda em VIDEO_FOLDER) até
+# ficar abaixo de LOW. Originais no arquivo frio não contam: /video não os
+# traz de volta, então o título sumiria do catálogo.
+STORAGE_HIGH_WATERMARK = float(os.getenv("STORAGE_HIGH_WATERMARK", "0.90"))
+STORAGE_LOW_WATERMARK = float(os.getenv("STORAGE_LOW_WATERMARK", "0.80"))
+STORAGE_CHECK_INTERVAL_S = 300
+# Títulos assistidos há menos tempo que isso nunca são despejados
+STORAGE_MIN_IDLE_S = 24 * 3600
+
+# Títulos despejados: o ingester não os retranscodifica sozinho (só sob demanda)
+storage_evicted = set()
+storage_stats = {"evictions": 0, "abr_evictions": 0, "evicted_bytes": 0, "verify_failures": 0}
+
+def init_storage_db():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS watch_stats (
+            filename TEXT PRIMARY KEY,
+            views INTEGER NOT NULL DEFAULT 0,
+            last_watched REAL NOT NULL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS storage_evictions (
+            filename TEXT PRIMARY KEY,
+            evicted_at REAL NOT NULL
+        )
+        """)
+        conn.commit()
+        c.execute("SELECT filename FROM storage_evictions")
+        storage_evicted.update(row[0] for row in c.fetchall())
+
+def record_watch(filename: str):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+        INSERT INTO watch_stats (filename, views, last_watched) VALUES (?, 1, ?)
+        ON CONFLICT(filename) DO UPDATE SET views = views + 1, last_watched = excluded.last_watched
+        """, (filename, time.time()))
+        conn.commit()
+
+def get_watch_stats() -> dict:
+    """
+    filename -> (visualizações, último acesso)
+    """
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT filename, views, last_watched FROM watch_stats")
+        return {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+def mark_storage_eviction(filename: str):
+    storage_evicted.add(filename)
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR REPLACE INTO storage_evictions (filename, evicted_at) VALUES (?, ?)",
+                  (filename, time.time()))
+        conn.commit()
+
+def clear_storage_eviction(filename: str):
+    if filename not in storage_evicted:
+        return
+    storage_evicted.discard(filename)
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM storage_evictions WHERE filename = ?", (filename,))
+        conn.commit()
+
+init_storage_db()
+
+async def verify_transcoded_output(original_file: str, transcoded_path: str) -> bool:
+    """
+    Confere com o ffprobe que o MP4 tem vídeo, tem áudio se o original
+    tinha, e a mesma duração (dentro da tolerância).
+    """
+    source = await get_media_metadata(original_file)
+    output = await get_media_metadata(transcoded_path)
+    if not source or not output or not output["video_codec"]:
+        return False
+    if source["audio_tracks"] and not output["audio_tracks"]:
+        return False
+    tolerance = max(VERIFY_DURATION_TOLERANCE_S, source["duration_s"] * VERIFY_DURATION_TOLERANCE_RATIO)
+    return abs(source["duration_s"] - output["duration_s"]) <= tolerance
+
+async def apply_source_retention(original_file: str, transcoded_path: str):
+    if SOURCE_RETENTION == "keep":
+        return
+    loop = asyncio.get_running_loop()
+    if SOURCE_RETENTION == "cold":
+        destination = os.path.join(COLD_FOLDER, os.path.basename(original_file))
+        try:
+            # Pode ser outro volume: shutil.move copia, então sai do event loop
+            await loop.run_in_executor(None, shutil.move, original_file, destination)
+            print(f"[Storage] Original movido para o arquivo frio: {destination}")
+        except Exception as e:
+            print(f"[Storage] Erro ao mover {original_file}: {e}")
+        return
+    if not await verify_transcoded_output(original_file, transcoded_path):
+        storage_stats["verify_failures"] += 1
+        print(f"[Storage] Verificação falhou, mantendo o original: {original_file}")
+        return
+    try:
+        os.remove(original_file)
+        print(f"[Transcode] Arquivo original removido: {original_file}")
+    except Exception as e:
+        print(f"[Transcode] Erro ao remover {original_file}: {e}")
+
+def storage_usage() -> tuple:
+    usage = shutil.disk_usage(TRANSCODED_FOLDER)
+    return usage.used, usage.total
+
+def eviction_candidates() -> list:
+    """
+    MP4 que podem ser regerados (original ainda em VIDEO_FOLDER), fora da
+    fila e sem acesso recente, do menos para o mais assistido.
+    """
+    with catalog_lock:
+        transcoded = list(catalog["transcodificados"])
+        originals = catalog["originais"]
+        candidates = [name for name in transcoded if name in originals]
+    stats = get_watch_stats()
+    now = time.time()
+    result = []
+    for name in candidates:
+        views, last_watched = stats.get(name, (0, 0.0))
+        if now - last_watched < STORAGE_MIN_IDLE_S or name in transcode_queue.jobs:
+            continue
+        result.append((views, last_watched, name))
+    result.sort()
+    return [name for _, _, name in result]
+
+def evict_transcoded_outputs() -> int:
+    """
+    Apaga escadas ABR e depois MP4 regeneráveis até o uso do disco ficar
+    abaixo da marca baixa. Retorna quantos foram apagados.
+    """
+    used, total = storage_usage()
+    if total <= 0 or used / total < STORAGE_HIGH_WATERMARK:
+        return 0
+    target = total * STORAGE_LOW_WATERMARK
+    evicted = 0
+
+    # Escadas ABR saem primeiro: são opcionais e sempre regeráveis (o loop
+    # ABR só recria quando couber abaixo da marca baixa)
+    stats = get_watch_stats()
+    now = time.time()
+    ladders = []
+    for name, path in abr_ladder_dirs():
+        views, last_watched = stats.get(name, (0, 0.0))
+        if now - last_watched >= STORAGE_MIN_IDLE_S:
+            ladders.append((views, last_watched, name, path))
+    ladders.sort()
+    for _, _, name, path in ladders:
+        if used <= target:
+            return evicted
+        size = dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        used -= size
+        evicted += 1
+        storage_stats["abr_evictions"] += 1
+        storage_stats["evicted_bytes"] += size
+        print(f"[Storage] Escada ABR despejada por falta de espaço: {name} ({size // (1024 * 1024)} MB)")
+
+    candidates = eviction_candidates()
+    if not candidates and SOURCE_RETENTION != "keep":
+        print(f"[Storage] Disco acima da marca alta, mas com SOURCE_RETENTION={SOURCE_RETENTION} "
+              f"não há MP4 regeneráveis para despejar")
+    for name in candidates:
+        if used <= target:
+            break
+        path = os.path.join(TRANSCODED_FOLDER, name + ".mp4")
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            continue
+        mark_storage_eviction(name)
+        invalidate_hot_segments(path)
+        used -= size
+        evicted += 1
+        storage_stats["evictions"] += 1
+        storage_stats["evicted_bytes"] += size
+        print(f"[Storage] MP4 despejado por falta de espaço: {name} ({size // (1024 * 1024)} MB)")
+    return evicted
+
+async def storage_manager_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, evict_transcoded_outputs)
+        except Exception as e:
+            print(f"[Storage] Erro na limpeza de espaço: {e}")
+        await asyncio.sleep(STORAGE_CHECK_INTERVAL_S)
+
+#########################################
+# PRÉ-TRANSCODIFICAÇÃO EM BACKGROUND
+#########################################
+
+INGEST_ENABLED = os.getenv("INGEST_ENABLED", "1") == "1"
+# Arquivo só entra na fila depois de ficar esse tempo sem ser modificado
+# (evita pegar cópias ainda em andamento)
+INGEST_SETTLE_S = int(os.getenv("INGEST_SETTLE_S", "120"))
+INGEST_SCAN_INTERVAL_S = int(os.getenv("INGEST_SCAN_INTERVAL_S", "30"))
+# Retorno de _ingest_ready para candidatos que nunca vão para a fila (saem
+# do conjunto; o watcher os traz de volta se o arquivo mudar)
+INGEST_DROP = "drop"
+
+ingest_lock = threading.Lock()
+ingest_candidates = set()     # originais ainda não transcodificados
+ingest_failed = {}            # nome -> mtime da versão que falhou
+# O event loop só guarda referência fraca das tasks: sem isso um job de
+# ingest pode ser coletado no meio do caminho e a exceção some calada.
+background_tasks = set()
+
+def _background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Tasks] Erro em {task.get_name()}: {task.exception()}")
+
+def spawn_background(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _on_video_folder_event_ingest(event: str, name):
+    if event == "rescan":
+        # O índice do catálogo é notificado antes e já releu a pasta
+        with catalog_lock:
+            fresh = set(catalog["originais"])
+        with ingest_lock:
+            ingest_candidates.clear()
+            ingest_candidates.update(fresh)
+        return
+    if _original_name(name) is None:
+        return
+    with ingest_lock:
+        if event == "add":
+            ingest_candidates.add(name)
+        else:
+            ingest_candidates.discard(name)
+
+folder_watcher.watch(VIDEO_FOLDER, _on_video_folder_event_ingest)
+
+def _on_transcoded_folder_event_ingest(event: str, name):
+    # MP4 apagado à mão volta a ser candidato (despejados são ignorados em
+    # _ingest_ready); o rescan da pasta de originais já cobre o resto
+    if event != "remove" or not name.endswith(".mp4"):
+        return
+    original = name[:-len(".mp4")]
+    if os.path.isfile(os.path.join(VIDEO_FOLDER, original)):
+        with ingest_lock:
+            ingest_candidates.add(original)
+
+folder_watcher.watch(TRANSCODED_FOLDER, _on_transcoded_folder_event_ingest)
+
+def _ingest_ready(name: str, now: float):
+    """
+    Retorna o caminho do original se ele deve ir para a fila agora, None se
+    ainda não (na fila, ou copiando) ou INGEST_DROP se nunca (já
+    transcodificado, despejado, sumiu ou esta versão já falhou).
+    """
+    original_path = os.path.join(VIDEO_FOLDER, name)
+    transcoded_path = os.path.join(TRANSCODED_FOLDER, name + ".mp4")
+    if name in transcode_queue.jobs:
+        return None
+    if name in storage_evicted or os.path.isfile(transcoded_path):
+        return INGEST_DROP
+    try:
+        st = os.stat(original_path)
+    except OSError:
+        return INGEST_DROP
+    if ingest_failed.get(name) == st.st_mtime:
+        return INGEST_DROP
+    if now - st.st_mtime < INGEST_SETTLE_S:
+        return None
+    return original_path
+
+async def _ingest_job(name: str, original_path: str):
+    if await get_transcode_decision(original_path) == DECISION_DIRECT:
+        # Já toca no navegador: nada a fazer
+        return
+    ok = await transcode_queue.submit(original_path, PRIORITY_BACKGROUND)
+    if not ok:
+        try:
+            ingest_failed[name] = os.stat(original_path).st_mtime
+        except OSError:
+            pass
+
+async def background_ingest_loop():
+    """
+    Periodicamente enfileira, com prioridade de background, os originais
+    novos e estáveis que ainda não foram transcodificados.
+    """
+    while True:
+        await asyncio.sleep(INGEST_SCAN_INTERVAL_S)
+        with ingest_lock:
+            names = sorted(ingest_candidates)
+        now = time.time()
+        for name in names:
+            original_path = _ingest_ready(name, now)
+            if original_path is None:
+                continue
+            if original_path == INGEST_DROP:
+                with ingest_lock:
+                    ingest_candidates.discard(name)
+                continue
+            print(f"[Ingest] Pré-transcodificação agendada: {name}")
+            spawn_background(_ingest_job(name, original_path), f"ingest:{name}")
+            with ingest_lock:
+                ingest_candidates.discard(name)
+
+@video_app.on_event("startup")
+async def start_transcode_queue():
+    purge_stale_hls()
+    await transcode_queue.start()
+    if INGEST_ENABLED:
+        spawn_background(background_ingest_loop(), "background_ingest_loop")
+    if ABR_ENABLED:
+        spawn_background(abr_ladder_loop(), "abr_ladder_loop")
+    spawn_background(media_probe_loop(), "media_probe_loop")
+    spawn_background(storage_manager_loop(), "storage_manager_loop")
+    spawn_background(session_sweep_loop(), "session_sweep_loop")
+
+#########################################
+# ESCADA ABR (HLS MULTI-BITRATE)
+#########################################
+
+# Depois que um título fica pronto em MP4, gera (em tempo ocioso) uma escada
+# HLS com várias resoluções e um master playlist; o player troca de
+# rendição sozinho conforme a banda do usuário. Opcional (ABR_ENABLED=1):
+# cada escada ocupa até ~9 Mbps x duração a mais no disco.
+ABR_ENABLED = os.getenv("ABR_ENABLED", "0") == "1"
+ABR_SCAN_INTERVAL_S = 60
+ABR_SEGMENT_S = 6
+ABR_AUDIO_BITRATE = "128k"
+# (altura, bitrate de vídeo, maxrate, bufsize)
+ABR_LADDER = [
+    (1080, "5000k", "5350k", "7500k"),
+    (720, "2800k", "2996k", "4200k"),
+    (480, "1400k", "1498k", "2100k"),
+]
+# Uma rendição só entra se tiver no máximo essa fração do bitrate da fonte
+# (não faz sentido "descer" para um bitrate igual ou maior que o original)
+ABR_MAX_SOURCE_BITRATE_RATIO = 0.8
+ABR_MASTER = "master.m3u8"
+ABR_FILE_RE = re.compile(r"^(index\.m3u8|seg_\d{5}\.ts)$")
+
+def get_abr_key(filename: str, st: os.stat_result) -> str:
+    """
+    Chave do diretório ABR: muda quando o MP4 muda, então os segmentos
+    podem ser servidos com cache imutável.
+    """
+    raw = f"{filename}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+def get_abr_source(filename: str) -> str | None:
+    """
+    MP4 do qual a escada é gerada: o transcodificado ou, se o original já
+    toca direto no navegador, o próprio original.
+    """
+    if filename in catalog["transcodificados"]:
+        return os.path.join(TRANSCODED_FOLDER, filename + ".mp4")
+    if cached_transcode_decision(filename) == DECISION_DIRECT:
+        return os.path.join(VIDEO_FOLDER, filename)
+    return None
+
+def get_abr_master_url(filename: str, server_url: str) -> str | None:
+    """
+    URL do master playlist do título, se a escada já estiver pronta.
+    """
+    if not ABR_ENABLED:
+        return None
+    source = get_abr_source(filename)
+    try:
+        st = os.stat(source) if source else None
+    except OSError:
+        return None
+    if st is None:
+        return None
+    key = get_abr_key(filename, st)
+    if not os.path.isfile(os.path.join(ABR_FOLDER, key, ABR_MASTER)):
+        return None
+    return f"{server_url}/abr/{key}/{ABR_MASTER}"
+
+def _bitrate_bps(value: str) -> int:
+    return int(value[:-1]) * 1000 if value.endswith("k") else int(value)
+
+def abr_rungs(meta: dict) -> list:
+    """
+    Degraus da escada que valem a pena para a fonte: nunca acima da altura
+    nem perto do bitrate dela. Lista vazia = a escada não ajudaria.
+    """
+    height = meta["height"] or 0
+    source_bps = meta["bit_rate"] or 0
+    return [
+        r for r in ABR_LADDER
+        if r[0] <= height
+        and (not source_bps or _bitrate_bps(r[1]) <= source_bps * ABR_MAX_SOURCE_BITRATE_RATIO)
+    ]
+
+def abr_estimated_bytes(meta: dict, rungs: list) -> int:
+    audio_bps = _bitrate_bps(ABR_AUDIO_BITRATE) if meta["audio_tracks"] else 0
+    total_bps = sum(_bitrate_bps(r[2]) + audio_bps for r in rungs)
+    return int(total_bps * (meta["duration_s"] or 0) / 8)
+
+def build_abr_command(source: str, out_dir: str, rungs: list, has_audio: bool) -> list:
+    n = len(rungs)
+    split = f"[0:v]split={n}" + "".join(f"[v{i}]" for i in range(n))
+    scales = ";".join(f"[v{i}]scale=-2:{h}[v{i}o]" for i, (h, _, _, _) in enumerate(rungs))
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", source,
+        "-filter_complex", f"{split};{scales}",
+    ]
+    stream_map = []
+    for i, (h, bitrate, maxrate, bufsize) in enumerate(rungs):
+        cmd += [
+            "-map", f"[v{i}o]",
+            f"-c:v:{i}", "libx264",
+            f"-b:v:{i}", bitrate,
+            f"-maxrate:v:{i}", maxrate,
+            f"-bufsize:v:{i}", bufsize,
+        ]
+        if has_audio:
+            cmd += ["-map", "0:a:0"]
+            stream_map.append(f"v:{i},a:{i},name:{h}p")
+        else:
+            stream_map.append(f"v:{i},name:{h}p")
+    if has_audio:
+        cmd += ["-c:a", "aac", "-b:a", ABR_AUDIO_BITRATE, "-ac", "2"]
+    cmd += [
+        "-preset", "veryfast",
+        # Keyframes alinhados entre as rendições para a troca ser limpa
+        "-force_key_frames", f"expr:gte(t,n_forced*{ABR_SEGMENT_S})",
+        "-sc_threshold", "0",
+        "-f", "hls",
+        "-hls_time", str(ABR_SEGMENT_S),
+        "-hls_playlist_type", "vod",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", os.path.join(out_dir, "%v", "seg_%05d.ts"),
+        "-master_pl_name", ABR_MASTER,
+        "-var_stream_map", " ".join(stream_map),
+        "-nostats",
+        os.path.join(out_dir, "%v", "index.m3u8"),
+    ]
+    return cmd
+
+async def build_abr_ladder(filename: str) -> bool:
+    """
+    Gera a escada ABR de um título já transcodificado, num diretório
+    temporário renomeado para o definitivo só no fim.
+    """
+    source = get_abr_source(filename)
+    try:
+        st = os.stat(source) if source else None
+    except OSError:
+        return False
+    if st is None:
+        return False
+    key = get_abr_key(filename, st)
+    final_dir = os.path.join(ABR_FOLDER, key)
+    tmp_dir = final_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = await get_media_metadata(source)
+    if not meta or not meta["video_codec"]:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    rungs = abr_rungs(meta)
+    if not rungs:
+        print(f"[ABR] Fonte já leve demais para uma escada: {filename}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    has_audio = bool(meta["audio_tracks"])
+
+    cmd = throttle_prefix() + build_abr_command(source, tmp_dir, rungs, has_audio)
+    print(f"[ABR] Gerando escada para {filename}")
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    await process.wait()
+    if process.returncode != 0 or not os.path.isfile(os.path.join(tmp_dir, ABR_MASTER)):
+        print(f"[ABR] Erro ao gerar escada para {filename}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    os.rename(tmp_dir, final_dir)
+    print(f"[ABR] Escada pronta: {filename}")
+    return True
+
+def _abr_wanted_keys() -> dict:
+    """
+    Mapa chave ABR -> título para todos os títulos prontos para tocar.
+    """
+    with catalog_lock:
+        names = catalog["filmes"]
+    wanted = {}
+    for name in names:
+        source = get_abr_source(name)
+        if source is None:
+            continue
+        try:
+            st = os.stat(source)
+        except OSError:
+            continue
+        wanted[get_abr_key(name, st)] = name
+    return wanted
+
+def abr_fits_on_disk(filename: str) -> bool:
+    """
+    Só gera uma escada se, depois dela, o disco continuar abaixo da marca
+    baixa do gerenciador de armazenamento (senão o despejo apagaria a
+    escada, ou MP4s, logo em seguida).
+    """
+    source = get_abr_source(filename)
+    meta = media_metadata_cache.get(source) if source else None
+    if not meta:
+        return True
+    used, total = storage_usage()
+    return total <= 0 or used + abr_estimated_bytes(meta, abr_rungs(meta)) <= total * STORAGE_LOW_WATERMARK
+
+def abr_ladder_dirs() -> list:
+    """
+    (título, diretório) das escadas prontas.
+    """
+    result = []
+    for key, name in _abr_wanted_keys().items():
+        path = os.path.join(ABR_FOLDER, key)
+        if os.path.isfile(os.path.join(path, ABR_MASTER)):
+            result.append((name, path))
+    return result
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+async def abr_ladder_loop():
+    """
+    Em tempo ocioso (fila de transcodificação vazia), gera uma escada por
+    vez e apaga as escadas de MP4 que mudaram ou sumiram.
+    """
+    failed = set()
+    while True:
+        await asyncio.sleep(ABR_SCAN_INTERVAL_S)
+        key = None
+        try:
+            wanted = _abr_wanted_keys()
+            existing = set(os.listdir(ABR_FOLDER))
+            for entry in existing:
+                if entry not in wanted:
+                    shutil.rmtree(os.path.join(ABR_FOLDER, entry), ignore_errors=True)
+            for key, name in sorted(wanted.items(), key=lambda kv: kv[1]):
+                if key in existing or key in failed:
+                    continue
+                if transcode_queue.jobs or not abr_fits_on_disk(name):
+                    break
+                if not await build_abr_ladder(name):
+                    failed.add(key)
+        except Exception as e:
+            print(f"[ABR] Erro na varredura: {e}")
+            # Não insiste na escada que levantou a exceção
+            if key is not None:
+                failed.add(key)
+
+#########################################
+# STREAMING DE ARQUIVOS
+#########################################
+
+STREAM_CHUNK_SIZE = 1024 * 512
+# Leituras de arquivo para as respostas ficam num pool próprio e limitado:
+# muitos players simultâneos não ocupam o executor padrão (usado por
+# ffprobe, disco do gerenciador de armazenamento, etc.) e vice-versa.
+STREAM_READ_WORKERS = int(os.getenv("STREAM_READ_WORKERS", "8"))
+stream_read_executor = ThreadPoolExecutor(max_workers=STREAM_READ_WORKERS, thread_name_prefix="pread")
+# Acima disso, um pedido multi-range é respondido com o arquivo inteiro
+MAX_RANGES_PER_REQUEST = 16
+
+class FileRangeResponse(Response):
+    """
+    Envia partes de um arquivo sem passar por um gerador síncrono. 'parts' é
+    uma lista de bytes literais (cabeçalhos de multipart) e tuplas
+    (start, count) do arquivo. Lê com os.pread no stream_read_executor,
+    sempre com a próxima leitura já agendada enquanto o bloco atual é
+    enviado (o uvicorn não oferece sendfile, então os bytes passam pelo
+    processo). Se o servidor ASGI oferecer a extensão
+    "http.response.zerocopysend", ela é usada e o kernel copia direto do
+    arquivo para o socket.
+    """
+
+    def __init__(self, path: str, parts: list, status_code: int = 200,
+                 headers: dict | None = None, media_type: str = "video/mp4",
+                 send_body: bool = True):
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.parts = parts
+        self.send_body = send_body
+        length = 0
+        for part in parts:
+            length += len(part) if isinstance(part, bytes) else part[1]
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or not self.parts:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        with open(self.path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            last = len(self.parts) - 1
+            for i, part in enumerate(self.parts):
+                more_body = i < last
+                if isinstance(part, bytes):
+                    await send({"type": "http.response.body", "body": part, "more_body": more_body})
+                    continue
+                start, count = part
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": f,
+                        "offset": start,
+                        "count": count,
+                        "more_body": more_body,
+                    })
+                    continue
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, start, count, os.POSIX_FADV_SEQUENTIAL)
+                if not await self._send_with_pread(send, fd, start, count, more_body):
+                    return
+
+    async def _send_with_pread(self, send, fd: int, start: int, count: int, more_body: bool) -> bool:
+        """
+        Envia [start, start + count) do fd. Retorna False se o arquivo acabou
+        antes do esperado (a resposta já foi encerrada).
+        """
+        if count <= 0:
+            if not more_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return True
+        loop = asyncio.get_running_loop()
+        offset = start
+        remaining = count
+        next_read = loop.run_in_executor(stream_read_executor, os.pread, fd, min(STREAM_CHUNK_SIZE, remaining), offset)
+        try:
+            while next_read is not None:
+                data = await next_read
+                next_read = None
+                if not data:
+                    break
+                offset += len(data)
+                remaining -= len(data)
+                if remaining > 0:
+                    next_read = loop.run_in_executor(stream_read_executor, os.pread, fd, min(STREAM_CHUNK_SIZE, remaining), offset)
+                await send({
+                    "type": "http.response.body",
+                    "body": data,
+                    "more_body": next_read is not None or more_body,
+                })
+            if remaining > 0:
+                # Arquivo encolheu durante o envio: encerra a resposta
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return False
+            return True
+        finally:
+            # Não fecha o fd com uma leitura ainda em andamento na thread
+            if next_read is not None:
+                try:
+                    await next_read
+                except Exception:
+                    pass
+
+#########################################
+# MOTOR DE RANGES HTTP (RFC 7233)
+#########################################
+
+def file_validators(st: os.stat_result):
+    """
+    Validadores fortes do arquivo: (ETag, Last-Modified).
+    """
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    return etag, formatdate(st.st_mtime, usegmt=True)
+
+def _etag_list(header: str) -> list:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _weak_etag_match(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    target = etag[2:] if etag.startswith("W/") else etag
+    for tag in _etag_list(header):
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == target:
+            return True
+    return False
+
+def _http_date(value: str):
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return dt.timestamp() if dt is not None else None
+
+RANGE_NUMBER_RE = re.compile(r"[0-9]+")
+
+def parse_range_header(header: str, size: int):
+    """
+    Interpreta um cabeçalho Range ("bytes=0-99,200-", "bytes=-500", ...).
+    Retorna None se o cabeçalho deve ser ignorado (sintaxe inválida, outra
+    unidade ou ranges demais), [] se nenhum range é satisfazível, ou a lista
+    de (start, end) inclusivos, ordenados e sem sobreposição.
+    """
+    unit, sep, spec = header.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, dash, last = item.partition("-")
+        first, last = first.strip(), last.strip()
+        # Só dígitos ASCII ("²".isdigit() é True, mas int("²") falha)
+        if not dash or (first and not RANGE_NUMBER_RE.fullmatch(first)) or \
+                (last and not RANGE_NUMBER_RE.fullmatch(last)):
+            return None
+        if not first:
+            # Sufixo: últimos N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            start = max(0, size - length)
+            end = size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            end = min(end, size - 1)
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES_PER_REQUEST:
+        return None
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def content_disposition(filename: str) -> str:
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+    return f'attachment; filename="{filename}"'
+
+def serve_file(request: Request, path: str, media_type: str, extra_headers: dict | None = None,
+               hot_segments: dict | None = None):
+    """
+    Responde GET/HEAD para um arquivo com suporte completo a ranges:
+    sufixos, múltiplos ranges (multipart/byteranges), If-Range e
+    requisições condicionais (If-None-Match / If-Modified-Since).
+    'hot_segments' (de get_hot_segments) permite servir o início e o fim
+    do arquivo direto da memória.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Filme não encontrado")
+    if hot_segments is not None and hot_segments["validator"] != (st.st_size, st.st_mtime_ns):
+        hot_segments = None
+    size = st.st_size
+    etag, last_modified = file_validators(st)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+    }
+    if extra_headers:
+        headers.update(extra_headers)
+    send_body = request.method != "HEAD"
+
+    # Requisições condicionais
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _weak_etag_match(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    else:
+        ims = request.headers.get("if-modified-since")
+        ims_ts = _http_date(ims) if ims else None
+        if ims_ts is not None and int(st.st_mtime) <= ims_ts:
+            return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    ranges = None
+    if range_header is not None:
+        if_range = request.headers.get("if-range")
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith('"') or if_range.startswith("W/"):
+                # If-Range com ETag exige comparação forte
+                use_range = if_range == etag
+            else:
+                use_range = if_range == last_modified
+        else:
+            use_range = True
+        if use_range:
+            ranges = parse_range_header(range_header, size)
+
+    if ranges is not None and not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    status_code = 206
+    if ranges is None:
+        status_code = 200
+        parts = [(0, size)]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        parts = [(start, end - start + 1)]
+    else:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for i, (start, end) in enumerate(ranges):
+            delimiter = "" if i == 0 else "\r\n"
+            part_head = (
+                f"{delimiter}--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            )
+            parts.append(part_head.encode("ascii"))
+            parts.append((start, end - start + 1))
+        parts.append(f"\r\n--{boundary}--\r\n".encode("ascii"))
+        media_type = f"multipart/byteranges; boundary={boundary}"
+
+    if hot_segments is not None and send_body:
+        parts = split_hot_parts(parts, hot_segments)
+    return FileRangeResponse(path, parts, status_code=status_code, headers=headers,
+                             media_type=media_type, send_body=send_body)
+
+#########################################
+# CACHE DE SEGMENTOS QUENTES (INÍCIO/FIM DOS MP4)
+#########################################
+
+# Início (ftyp/moov + primeiros segundos, graças ao faststart) e fim de cada
+# arquivo servido por /video ficam em memória, num LRU limitado por
+# quantidade de arquivos e por bytes.
+HOT_HEAD_BYTES = 8 * 1024 * 1024
+HOT_TAIL_BYTES = 1 * 1024 * 1024
+HOT_CACHE_MAX_FILES = 32
+HOT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+hot_cache_lock = threading.Lock()
+hot_cache = OrderedDict()     # path -> {"validator", "head", "tail_start", "tail", "bytes"}
+hot_cache_loading = {}        # path -> asyncio.Task (evita leituras duplicadas)
+hot_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "invalidations": 0,
+    "bytes_served": 0,
+}
+
+def _read_hot_segments(path: str) -> dict | None:
+    with open(path, "rb", buffering=0) as f:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        if size <= 0:
+            return None
+        head = os.pread(f.fileno(), min(HOT_HEAD_BYTES, size), 0)
+        tail_start = max(len(head), size - HOT_TAIL_BYTES)
+        tail = os.pread(f.fileno(), size - tail_start, tail_start) if tail_start < size else b""
+    return {
+        "validator": (st.st_size, st.st_mtime_ns),
+        "head": head,
+        "tail_start": tail_start,
+        "tail": tail,
+        "bytes": len(head) + len(tail),
+    }
+
+def _hot_cache_store(path: str, entry: dict):
+    with hot_cache_lock:
+        old = hot_cache.pop(path, None)
+        hot_cache[path] = entry
+        total = sum(e["bytes"] for e in hot_cache.values())
+        while hot_cache and (len(hot_cache) > HOT_CACHE_MAX_FILES or total > HOT_CACHE_MAX_BYTES):
+            _, evicted = hot_cache.popitem(last=False)
+            total -= evicted["bytes"]
+            hot_cache_stats["evictions"] += 1
+        if old is not None and old["validator"] != entry["validator"]:
+            hot_cache_stats["invalidations"] += 1
+
+def invalidate_hot_segments(path: str):
+    with hot_cache_lock:
+        if hot_cache.pop(path, None) is not None:
+            hot_cache_stats["invalidations"] += 1
+
+async def _fill_hot_segments(path: str, validator: tuple) -> dict | None:
+    loop = asyncio.get_running_loop()
+    try:
+        entry = await loop.run_in_executor(None, _read_hot_segments, path)
+    except Exception as e:
+        print(f"[HotCache] Erro ao ler {path}: {e}")
+        return None
+    if entry is not None and entry["validator"] == validator:
+        _hot_cache_store(path, entry)
+    return entry
+
+def get_hot_segments(path: str) -> dict | None:
+    """
+    Retorna os segmentos quentes do arquivo se já estiverem no cache. Se não
+    estiverem (ou o arquivo mudou), agenda a leitura em segundo plano (uma
+    só, mesmo com vários pedidos simultâneos) e retorna None: o pedido atual
+    é servido direto do disco, sem esperar os ~9 MB do início/fim.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    validator = (st.st_size, st.st_mtime_ns)
+    with hot_cache_lock:
+        entry = hot_cache.get(path)
+        if entry is not None and entry["validator"] == validator:
+            hot_cache.move_to_end(path)
+            hot_cache_stats["hits"] += 1
+            return entry
+        hot_cache_stats["misses"] += 1
+
+    if path not in hot_cache_loading:
+        task = asyncio.ensure_future(_fill_hot_segments(path, validator))
+        hot_cache_loading[path] = task
+        task.add_done_callback(lambda _t: hot_cache_loading.pop(path, None))
+    return None
+
+def split_hot_parts(parts: list, hot: dict) -> list:
+    """
+    Troca os trechos (start, count) cobertos pelo início/fim em memória por
+    bytes literais, deixando só o miolo para ser lido do disco.
+    """
+    head = hot["head"]
+    tail = hot["tail"]
+    tail_start = hot["tail_start"]
+    tail_end = tail_start + len(tail)
+    out = []
+    served = 0
+    for part in parts:
+        if isinstance(part, bytes):
+            out.append(part)
+            continue
+        start, count = part
+        end = start + count
+        if start < len(head):
+            cut = min(end, len(head))
+            out.append(head[start:cut])
+            served += cut - start
+            start = cut
+        if start < end:
+            middle_end = min(end, tail_start) if tail else end
+            if start < middle_end:
+                out.append((start, middle_end - start))
+                start = middle_end
+            if start < end and tail and start >= tail_start and end <= tail_end:
+                out.append(tail[start - tail_start:end - tail_start])
+                served += end - start
+            elif start < end:
+                out.append((start, end - start))
+    hot_cache_stats["bytes_served"] += served
+    return out
+
+def _on_transcoded_folder_event_hot(event: str, name):
+    if event == "rescan":
+        with hot_cache_lock:
+            paths = list(hot_cache)
+        for path in paths:
+            try:
+                st = os.stat(path)
+                validator = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                validator = None
+            entry = hot_cache.get(path)
+            if entry is not None and entry["validator"] != validator:
+                invalidate_hot_segments(path)
+        return
+    invalidate_hot_segments(os.path.join(TRANSCODED_FOLDER, name))
+
+folder_watcher.watch(TRANSCODED_FOLDER, _on_transcoded_folder_event_hot)
+
+#########################################
+# CACHE DA PÁGINA INICIAL
+#########################################
+
+# Partes fixas da página inicial, já codificadas. Só a barra superior
+# (nome do usuário / link de admin) e a grade de filmes variam.
+HOME_HEAD_HTML = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Filmes do Boteco</title>
+        <style>
+            @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap');
+            @keyframes fadeIn {
+                from { opacity: 0; }
+                to { opacity: 1; }
+            }
+            body {
+                font-family: 'Roboto', sans-serif;
+                margin: 0;
+                padding: 0;
+                background: linear-gradient(135deg, #1abc9c, #16a085);
+                color: #fff;
+            }
+            .top-bar {
+                position: fixed;
+                top: 0;
+                left: 0;
+                width: 100%;
+                height: 60px;
+                background: rgba(0, 0, 0, 0.7);
+                display: flex;
+                align-items: center;
+                justify-content: space-between;
+                padding: 0 20px;
+                z-index: 1000;
+                animation: fadeIn 1s ease-in-out;
+            }
+            .top-bar .title {
+                font-size: 1.5rem;
+                font-weight: bold;
+                color: #1abc9c;
+                text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
+            }
+            .top-bar .menu {
+                display: flex;
+                flex-wrap: wrap;
+                gap: 10px;
+            }
+            .top-bar .menu a {
+                margin-left: 15px;
+                padding: 8px 16px;
+                background: #2980b9;
+                border-radius: 8px;
+                text-decoration: none;
+                color: #fff;
+                transition: background 0.3s;
+            }
+            .top-bar .menu a:hover {
+                background: #3498db;
+            }
+            .content {
+                padding-top: 80px;
+                padding-bottom: 60px;
+                animation: fadeIn 2s ease-in-out;
+            }
+            .container {
+                display: flex;
+                flex-wrap: wrap;
+                justify-content: center;
+                gap: 20px;
+                padding: 20px;
+            }
+            .card {
+                background: rgba(255, 255, 255, 0.1);
+                border: 1px solid rgba(255, 255, 255, 0.2);
+                border-radius: 15px;
+                width: 200px;
+                overflow: hidden;
+                text-align: center;
+                transition: transform 0.3s, box-shadow 0.3s;
+            }
+            .card:hover {
+                transform: scale(1.05);
+                box-shadow: 0 8px 16px rgba(0,0,0,0.3);
+            }
+            .card img {
+                width: 100%;
+                height: 300px;
+                object-fit: cover;
+                border-bottom: 1px solid rgba(255, 255, 255, 0.2);
+            }
+            .card-title {
+                padding: 15px 10px;
+                font-size: 1.1rem;
+                font-weight: bold;
+            }
+            .card a {
+                display: inline-block;
+                margin: 10px 0;
+                padding: 10px 20px;
+                background: #e67e22;
+                color: #fff;
+                border-radius: 8px;
+                text-decoration: none;
+                transition: background 0.3s;
+            }
+            .card a:hover {
+                background: #d35400;
+            }
+            .presentation {
+                max-width: 800px;
+                margin: 20px auto;
+                text-align: center;
+                padding: 20px;
+                background: rgba(255, 255, 255, 0.1);
+                border-radius: 15px;
+                box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.37);
+                backdrop-filter: blur(8.5px);
+                -webkit-backdrop-filter: blur(8.5px);
+                border: 1px solid rgba(255, 255, 255, 0.18);
+                animation: fadeIn 1.5s ease-in-out;
+            }
+            .presentation h2 {
+                margin-bottom: 15px;
+            }
+            .presentation p {
+                line-height: 1.6;
+            }
+            .search-box {
+                display: block;
+                width: 100%;
+                max-width: 500px;
+                margin: 20px auto 0;
+                padding: 12px 16px;
+                border: none;
+                border-radius: 8px;
+                outline: none;
+                font-size: 1rem;
+                box-sizing: border-box;
+                transition: box-shadow 0.3s;
+            }
+            .search-box:focus {
+                box-shadow: 0 0 10px rgba(255, 255, 255, 0.7);
+            }
+            .discord-link img {
+                height: 40px;
+                transition: transform 0.3s;
+            }
+            .discord-link img:hover {
+                transform: scale(1.1);
+            }
+            .nerd-container {
+                text-align: center;
+                padding: 20px;
+            }
+            .nerd-container img {
+                max-width: 400px;
+                width: 100%;
+                border: 2px solid #1abc9c;
+                border-radius: 10px;
+                animation: fadeIn 2s ease-in-out;
+            }
+            footer {
+                position: fixed;
+                bottom: 0;
+                left: 0;
+                width: 100%;
+                background: rgba(0, 0, 0, 0.7);
+                text-align: center;
+                padding: 15px 0;
+                color: #ecf0f1;
+                font-size: 0.9rem;
+                animation: fadeIn 1s ease-in-out;
+            }
+            @media (max-width: 600px) {
+                .top-bar {
+                    flex-direction: column;
+                    align-items: flex-start;
+                    padding: 10px;
+                    height: auto;
+                }
+                .top-bar .title {
+                    margin-bottom: 10px;
+                }
+                .top-bar .menu a {
+                    width: 100%;
+                    text-align: center;
+                }
+                .card {
+                    width: 100%;
+                }
+                .presentation {
+                    margin: 10px;
+                    padding: 15px;
+                }
+            }
+        </style>
+    </head>
+    <body>
+""".encode("utf-8")
+
+HOME_PRESENTATION_HTML = """
+    <div class="content">
+        <div class="presentation">
+            <h2>Bem-vindo ao Filmes do Boteco!</h2>
+            <p>Este serviço é exclusivo para membros aprovados do nosso servidor Discord. Aqui você pode assistir aos melhores filmes selecionados, todos disponíveis em alta qualidade. Navegue pela nossa lista de filmes e aproveite!</p>
+            <div class="discord-link">
+                <a href="https://discord.gg/daJ6hHHfG4" target="_blank">
+                    <img src="/imagens/discord.png" alt="Discord" />
+                </a>
+            </div>
+            <input type="search" id="search-box" class="search-box" placeholder="Buscar filme..." autocomplete="off" />
+        </div>
+        <div class="container" id="search-results" style="display: none;"></div>
+        <div class="container" id="catalog-grid">
+""".encode("utf-8")
+
+HOME_FOOTER_HTML = """
+        </div> <!-- .container -->
+        <div class="nerd-container">
+            <img src="/imagens/nerd.jpg" alt="Nerd" />
+        </div>
+    </div> <!-- .content -->
+    <footer>
+        <p>© 2025 - By Eletriom</p>
+    </footer>
+    <script>
+      function createCard(filme) {
+        const card = document.createElement('div');
+        card.className = 'card';
+        const img = document.createElement('img');
+        img.src = filme.capa;
+        img.alt = filme.titulo;
+        img.loading = 'lazy';
+        const title = document.createElement('div');
+        title.className = 'card-title';
+        title.textContent = filme.titulo;
+        const link = document.createElement('a');
+        link.href = filme.link;
+        link.textContent = 'Assistir';
+        card.append(img, title, link);
+        return card;
+      }
+
+      // Busca por título: troca a grade pelo resultado enquanto há texto na caixa
+      (function() {
+        const input = document.getElementById('search-box');
+        const grid = document.getElementById('catalog-grid');
+        const results = document.getElementById('search-results');
+        let timer = null;
+        let lastQuery = '';
+
+        async function runSearch(query) {
+          try {
+            const resp = await fetch('/api/busca?q=' + encodeURIComponent(query));
+            if (!resp.ok || query !== lastQuery) return;
+            const data = await resp.json();
+            results.replaceChildren(...data.filmes.map(createCard));
+            if (!data.filmes.length) {
+              const empty = document.createElement('p');
+              empty.style.color = '#ecf0f1';
+              empty.textContent = 'Nenhum filme encontrado.';
+              results.append(empty);
+            }
+          } catch(e) {
+            console.log(e);
+          }
+        }
+
+        input.addEventListener('input', () => {
+          clearTimeout(timer);
+          lastQuery = input.value.trim();
+          if (!lastQuery) {
+            results.style.display = 'none';
+            grid.style.display = '';
+            return;
+          }
+          grid.style.display = 'none';
+          results.style.display = '';
+          timer = setTimeout(() => runSearch(lastQuery), 150);
+        });
+      })();
+
+      // Carrega o restante do catálogo em páginas conforme o usuário rola
+      (function() {
+        const container = document.getElementById('catalog-grid');
+        const sentinel = document.getElementById('scroll-sentinel');
+        if (!sentinel) return;
+        let cursor = sentinel.dataset.cursor;
+        let loading = false;
+
+        function addCard(filme) {
+          container.insertBefore(createCard(filme), sentinel);
+        }
+
+        function nearBottom() {
+          if (container.style.display === 'none') return false;
+          return sentinel.getBoundingClientRect().top < window.innerHeight + 600;
+        }
+
+        async function loadMore() {
+          if (loading || !cursor) return;
+          loading = true;
+          try {
+            const resp = await fetch('/api/filmes?cursor=' + encodeURIComponent(cursor));
+            if (!resp.ok) return;
+            const data = await resp.json();
+            data.filmes.forEach(addCard);
+            cursor = data.next_cursor;
+          } catch(e) {
+            console.log(e);
+          } finally {
+            loading = false;
+          }
+          if (!cursor) {
+            observer.disconnect();
+            sentinel.remove();
+          } else if (nearBottom()) {
+            loadMore();
+          }
+        }
+
+        const observer = new IntersectionObserver((entries) => {
+          if (entries.some((e) => e.isIntersecting)) loadMore();
+        }, { rootMargin: '600px' });
+        observer.observe(sentinel);
+      })();
+    </script>
+    </body>
+    </html>
+""".encode("utf-8")
+
+# Primeira página da grade de filmes, reconstruída apenas quando o catálogo
+# ou o mapa de capas mudam (uma vez por mudança, não uma vez por visitante).
+home_grid_lock = threading.Lock()
+home_grid_cache = {"key": None, "body": b""}
+
+def render_home_grid(server_url: str):
+    """
+    Retorna (chave, bytes) da grade de filmes para a versão atual do catálogo.
+    """
+    key = (catalog["version"], asset_stats["version"])
+    if home_grid_cache["key"] == key:
+        return key, home_grid_cache["body"]
+    with home_grid_lock:
+        # Outro request pode ter reconstruído enquanto esperávamos o lock
+        if home_grid_cache["key"] == key:
+            return key, home_grid_cache["body"]
+        # Só a primeira página vai no HTML; o resto vem de /api/filmes
+        filmes, next_cursor, _ = catalog_page("nome", None, CATALOG_PAGE_SIZE, None, None)
+        html_body = ""
+        if not filmes:
+            html_body += "<p style='color: #ecf0f1;'>Nenhum filme disponível no momento.</p>"
+        else:
+            parts = []
+            for v in filmes:
+                titulo = format_title(v)
+                cover_url = get_cover_image(v)
+                link = f"{server_url}/filmes?filename={v}"
+                parts.append(f"""
+            <div class="card">
+                <img src="{cover_url}" alt="{titulo}" />
+                <div class="card-title">{titulo}</div>
+                <a href="{link}">Assistir</a>
+            </div>
+            """)
+            if next_cursor:
+                parts.append(f"""
+            <div id="scroll-sentinel" data-cursor="{next_cursor}" style="width: 100%; height: 1px;"></div>
+            """)
+            html_body = "".join(parts)
+        body = html_body.encode("utf-8")
+        home_grid_cache["body"] = body
+        home_grid_cache["key"] = key
+        return key, body
+
+#########################################
+# ENDPOINTS FASTAPI
+#########################################
+
+@video_app.get("/ads.txt", response_class=PlainTextResponse)
+def ads_txt():
+    return "google.com, pub-6682849033272336, DIRECT, f08c47fec0942fa0"
+
+@video_app.get("/list")
+def list_filmes():
+    """
+    Lista os filmes a partir do índice em memória (sem varrer as pastas).
+    """
+    return {"filmes": catalog["filmes"]}
+
+@video_app.get("/api/filmes")
+async def api_list_filmes(request: Request, cursor: str | None = None, limit: int = CATALOG_PAGE_SIZE,
+                    sort: str = "nome", q: str | None = None, prefix: str | None = None):
+    """
+    Catálogo paginado por cursor, com filtro por prefixo do nome do arquivo,
+    busca por trecho do título e ordenação ('nome', '-nome' ou 'recentes').
+    """
+    principal = await session_principal(request)
+    if not principal or not principal.approved:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    if sort not in CATALOG_SORTS:
+        raise HTTPException(status_code=400, detail="Ordenação inválida")
+    limit = max(1, min(limit, CATALOG_MAX_PAGE_SIZE))
+
+    server_url = "http://eletriom.com.br:25614"
+    page, next_cursor, total = catalog_page(sort, cursor, limit, q, prefix)
+    return {
+        "filmes": [catalog_item(f, server_url) for f in page],
+        "next_cursor": next_cursor,
+        "total": total,
+        "version": catalog["version"],
+    }
+
+@video_app.get("/api/busca")
+async def api_search_filmes(request: Request, q: str, limit: int = SEARCH_MAX_RESULTS):
+    """
+    Busca por título no índice invertido (sem acentos, por prefixo de palavra).
+    """
+    principal = await session_principal(request)
+    if not principal or not principal.approved:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    limit = max(1, min(limit, CATALOG_MAX_PAGE_SIZE))
+
+    server_url = "http://eletriom.com.br:25614"
+    filmes, total = search_titles(q, limit)
+    return {
+        "filmes": [catalog_item(f, server_url) for f in filmes],
+        "total": total,
+    }
+
+@video_app.get("/stats")
+async def get_stats(request: Request):
+    """
+    Métricas internas (catálogo, acertos/erros do mapa de capas/legendas,
+    cache de segmentos e armazenamento).
+    Somente admins podem acessar.
+    """
+    principal = await session_principal(request)
+    if not principal or not principal.admin:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    used, total = storage_usage()
+    return {
+        "catalog": {
+            "version": catalog["version"],
+            "filmes": len(catalog["filmes"]),
+            "inotify": folder_watcher.inotify_active,
+        },
+        "assets": {
+            "capas": len(asset_maps["capas"]),
+            "legendas": len(asset_maps["legendas"]),
+            **asset_stats,
+        },
+        "hot_cache": {
+            "files": len(hot_cache),
+            "bytes": sum(e["bytes"] for e in list(hot_cache.values())),
+            **hot_cache_stats,
+        },
+        "storage": {
+            "retention": SOURCE_RETENTION,
+            "used": used,
+            "total": total,
+            "evicted_titles": len(storage_evicted),
+            "abr_bytes": await asyncio.get_running_loop().run_in_executor(None, dir_size, ABR_FOLDER),
+            **storage_stats,
+        },
+    }
 
-@video_app.get("/list")
-def list_filmes():
-    supported_exts = (".mp4", ".mkv", ".avi", ".mov", ".flv")
-    orig_files = []
-    if os.path.exists(VIDEO_FOLDER):
-        for f in os.listdir(VIDEO_FOLDER):
-            if f.lower().endswith(supported_exts):
-                orig_files.append(f)
-    transcoded_files = []
-    if os.path.exists(TRANSCODED_FOLDER):
-        for f in os.listdir(TRANSCODED_FOLDER):
-            if f.lower().endswith(".mp4"):
-                base_no_mp4, _ = os.path.splitext(f)
-                transcoded_files.append(base_no_mp4)
-
-    all_files = set(orig_files + transcoded_files)
-    return {"filmes": sorted(all_files)}
-
-@video_app.get("/download")
-def download_video(filename: str):
+@video_app.api_route("/download", methods=["GET", "HEAD"])
+def download_video(request: Request, filename: str):
     transcoded_path = os.path.join(TRANSCODED_FOLDER, filename + ".mp4")
+    download_headers = {"Content-Disposition": content_disposition(filename)}
     if os.path.isfile(transcoded_path):
-        return FileResponse(transcoded_path, media_type='application/octet-stream', filename=filename)
+        return serve_file(request, transcoded_path, "application/octet-stream", download_headers)
     original_path = os.path.join(VIDEO_FOLDER, filename)
     if not os.path.isfile(original_path):
         raise HTTPException(status_code=404, detail="Filme não encontrado")
-    return FileResponse(original_path, media_type='application/octet-stream', filename=filename)
+    return serve_file(request, original_path, "application/octet-stream", download_headers)
 
 @video_app.get("/", response_class=HTMLResponse)
-def read_root(request: Request):
+async def read_root(request: Request):
     """
     Página inicial. Somente exibe a lista de filmes se o usuário estiver logado e aprovado.
     Caso contrário, exibe mensagem ou redireciona para login.
     """
-    session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    username = get_current_username_from_session(session_id)
+    principal = await session_principal(request)
+    username = principal.username if principal else None
 
     if not username:
         # Usuário não logado
@@ -1277,7 +4973,7 @@ def read_root(request: Request):
         """
         return HTMLResponse(html, status_code=200)
 
-    if not is_approved_user(username):
+    if not principal.approved:
         # Usuário logado mas não aprovado
         html = """
         <!DOCTYPE html>
@@ -1356,8 +5052,15 @@ def read_root(request: Request):
 
     # Se chegou aqui, está logado e aprovado
     server_url = "http://eletriom.com.br:25614"
-    data = list_filmes()
-    filmes = data.get("filmes", [])
+    user_is_admin = principal.admin
+    grid_key, grid_body = render_home_grid(server_url)
+
+    # ETag depende da versão do catálogo/capas e da barra superior do usuário
+    etag_src = f"{grid_key}|{username}|{user_is_admin}".encode("utf-8")
+    etag = '"' + hashlib.sha1(etag_src).hexdigest() + '"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
 
     # Top bar
     top_bar = f"""
@@ -1365,240 +5068,24 @@ def read_root(request: Request):
         <div class="title">Bem-vindo, {username}!</div>
         <div class="menu">
             <a href="/logout" class="btn">Logout</a>
-            {"<a href='/admin' class='btn'>Admin</a>" if is_admin(username) else ""}
+            {"<a href='/admin' class='btn'>Admin</a>" if user_is_admin else ""}
         </div>
     </div>
     """
 
-    html_header = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Filmes do Boteco</title>
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap');
-            @keyframes fadeIn {{
-                from {{ opacity: 0; }}
-                to {{ opacity: 1; }}
-            }}
-            body {{
-                font-family: 'Roboto', sans-serif;
-                margin: 0;
-                padding: 0;
-                background: linear-gradient(135deg, #1abc9c, #16a085);
-                color: #fff;
-            }}
-            .top-bar {{
-                position: fixed;
-                top: 0;
-                left: 0;
-                width: 100%;
-                height: 60px;
-                background: rgba(0, 0, 0, 0.7);
-                display: flex;
-                align-items: center;
-                justify-content: space-between;
-                padding: 0 20px;
-                z-index: 1000;
-                animation: fadeIn 1s ease-in-out;
-            }}
-            .top-bar .title {{
-                font-size: 1.5rem;
-                font-weight: bold;
-                color: #1abc9c;
-                text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-            }}
-            .top-bar .menu {{
-                display: flex;
-                flex-wrap: wrap;
-                gap: 10px;
-            }}
-            .top-bar .menu a {{
-                margin-left: 15px;
-                padding: 8px 16px;
-                background: #2980b9;
-                border-radius: 8px;
-                text-decoration: none;
-                color: #fff;
-                transition: background 0.3s;
-            }}
-            .top-bar .menu a:hover {{
-                background: #3498db;
-            }}
-            .content {{
-                padding-top: 80px;
-                padding-bottom: 60px;
-                animation: fadeIn 2s ease-in-out;
-            }}
-            .container {{
-                display: flex;
-                flex-wrap: wrap;
-                justify-content: center;
-                gap: 20px;
-                padding: 20px;
-            }}
-            .card {{
-                background: rgba(255, 255, 255, 0.1);
-                border: 1px solid rgba(255, 255, 255, 0.2);
-                border-radius: 15px;
-                width: 200px;
-                overflow: hidden;
-                text-align: center;
-                transition: transform 0.3s, box-shadow 0.3s;
-            }}
-            .card:hover {{
-                transform: scale(1.05);
-                box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-            }}
-            .card img {{
-                width: 100%;
-                height: 300px;
-                object-fit: cover;
-                border-bottom: 1px solid rgba(255, 255, 255, 0.2);
-            }}
-            .card-title {{
-                padding: 15px 10px;
-                font-size: 1.1rem;
-                font-weight: bold;
-            }}
-            .card a {{
-                display: inline-block;
-                margin: 10px 0;
-                padding: 10px 20px;
-                background: #e67e22;
-                color: #fff;
-                border-radius: 8px;
-                text-decoration: none;
-                transition: background 0.3s;
-            }}
-            .card a:hover {{
-                background: #d35400;
-            }}
-            .presentation {{
-                max-width: 800px;
-                margin: 20px auto;
-                text-align: center;
-                padding: 20px;
-                background: rgba(255, 255, 255, 0.1);
-                border-radius: 15px;
-                box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.37);
-                backdrop-filter: blur(8.5px);
-                -webkit-backdrop-filter: blur(8.5px);
-                border: 1px solid rgba(255, 255, 255, 0.18);
-                animation: fadeIn 1.5s ease-in-out;
-            }}
-            .presentation h2 {{
-                margin-bottom: 15px;
-            }}
-            .presentation p {{
-                line-height: 1.6;
-            }}
-            .discord-link img {{
-                height: 40px;
-                transition: transform 0.3s;
-            }}
-            .discord-link img:hover {{
-                transform: scale(1.1);
-            }}
-            .nerd-container {{
-                text-align: center;
-                padding: 20px;
-            }}
-            .nerd-container img {{
-                max-width: 400px;
-                width: 100%;
-                border: 2px solid #1abc9c;
-                border-radius: 10px;
-                animation: fadeIn 2s ease-in-out;
-            }}
-            footer {{
-                position: fixed;
-                bottom: 0;
-                left: 0;
-                width: 100%;
-                background: rgba(0, 0, 0, 0.7);
-                text-align: center;
-                padding: 15px 0;
-                color: #ecf0f1;
-                font-size: 0.9rem;
-                animation: fadeIn 1s ease-in-out;
-            }}
-            @media (max-width: 600px) {{
-                .top-bar {{
-                    flex-direction: column;
-                    align-items: flex-start;
-                    padding: 10px;
-                    height: auto;
-                }}
-                .top-bar .title {{
-                    margin-bottom: 10px;
-                }}
-                .top-bar .menu a {{
-                    width: 100%;
-                    text-align: center;
-                }}
-                .card {{
-                    width: 100%;
-                }}
-                .presentation {{
-                    margin: 10px;
-                    padding: 15px;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-    {top_bar}
-    <div class="content">
-        <div class="presentation">
-            <h2>Bem-vindo ao Filmes do Boteco!</h2>
-            <p>Este serviço é exclusivo para membros aprovados do nosso servidor Discord. Aqui você pode assistir aos melhores filmes selecionados, todos disponíveis em alta qualidade. Navegue pela nossa lista de filmes e aproveite!</p>
-            <div class="discord-link">
-                <a href="https://discord.gg/daJ6hHHfG4" target="_blank">
-                    <img src="/imagens/discord.png" alt="Discord" />
-                </a>
-            </div>
-        </div>
-        <div class="container">
-    """
-
-    html_body = ""
-    if not filmes:
-        html_body += "<p style='color: #ecf0f1;'>Nenhum filme disponível no momento.</p>"
-    else:
-        for v in filmes:
-            titulo = format_title(v)
-            cover_url = get_cover_image(v)
-            link = f"{server_url}/filmes?filename={v}"
-            html_body += f"""
-            <div class="card">
-                <img src="{cover_url}" alt="{titulo}" />
-                <div class="card-title">{titulo}</div>
-                <a href="{link}">Assistir</a>
-            </div>
-            """
-
-    html_footer = """
-        </div> <!-- .container -->
-        <div class="nerd-container">
-            <img src="/imagens/nerd.jpg" alt="Nerd" />
-        </div>
-    </div> <!-- .content -->
-    <footer>
-        <p>© 2025 - By Eletriom</p>
-    </footer>
-    </body>
-    </html>
-    """
-
-    return HTMLResponse(html_header + html_body + html_footer)
+    content = b"".join((
+        HOME_HEAD_HTML,
+        top_bar.encode("utf-8"),
+        HOME_PRESENTATION_HTML,
+        grid_body,
+        HOME_FOOTER_HTML,
+    ))
+    return HTMLResponse(content, headers=cache_headers)
 
 @video_app.get("/filmes", response_class=HTMLResponse)
 async def plyr_player(request: Request, filename: str):
-    session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    username = get_current_username_from_session(session_id)
-    if not username or not is_approved_user(username):
+    principal = await session_principal(request)
+    if not principal or not principal.approved:
         html = """
         <!DOCTYPE html>
         <html>
@@ -1682,32 +5169,42 @@ async def plyr_player(request: Request, filename: str):
 
     progress_info = transcoding_progress.get(filename)
 
-    if progress_info and progress_info["status"] == "in_progress":
+    if progress_info and progress_info["status"] in ("queued", "in_progress"):
+        if progress_info["status"] == "in_progress" and TRANSCODE_PROGRESSIVE and hls_playable(filename):
+            # Já dá para assistir pelos segmentos HLS enquanto o MP4 termina
+            hls_url = f"{server_url}/hls/{get_hls_key(filename)}/{HLS_PLAYLIST}"
+            meta = await get_media_metadata(original_path)
+            queue_db_write(record_watch, filename)
+            return HTMLResponse(content=player_page_html(nome_formatado, filename, server_url, download_url,
+                                                         hls_url, meta),
+                                status_code=200)
         return HTMLResponse(content=progress_page_html(nome_formatado, filename), status_code=200)
 
-    if progress_info and progress_info["status"] == "done" and os.path.isfile(transcoded_path):
-        return HTMLResponse(content=player_page_html(nome_formatado, filename, server_url, download_url), status_code=200)
-
     if os.path.isfile(transcoded_path):
-        return HTMLResponse(content=player_page_html(nome_formatado, filename, server_url, download_url), status_code=200)
+        # Com a escada ABR pronta, o player escolhe a rendição pela banda
+        abr_url = get_abr_master_url(filename, server_url)
+        meta = await get_media_metadata(transcoded_path)
+        queue_db_write(record_watch, filename)
+        return HTMLResponse(content=player_page_html(nome_formatado, filename, server_url, download_url,
+                                                     abr_url, meta),
+                            status_code=200)
 
     if os.path.isfile(original_path):
-        transcoding_progress[filename] = {
-            "percent": 0.0,
-            "eta": 0.0,
-            "status": "in_progress",
-            "start_time": time.time(),
-            "duration_s": 0.0,
-        }
-        if filename not in transcoding_tasks or transcoding_tasks[filename].done():
-            task = asyncio.create_task(transcode_file(original_path, transcoded_path))
-            transcoding_tasks[filename] = task
-
+        meta = await get_media_metadata(original_path)
+        if transcode_decision(meta) == DECISION_DIRECT:
+            # O original já toca no navegador: sem fila, sem espera
+            abr_url = get_abr_master_url(filename, server_url)
+            queue_db_write(record_watch, filename)
+            return HTMLResponse(content=player_page_html(nome_formatado, filename, server_url, download_url,
+                                                         abr_url, meta),
+                                status_code=200)
+        transcode_queue.submit(original_path, PRIORITY_USER)
         return HTMLResponse(content=progress_page_html(nome_formatado, filename), status_code=200)
 
     raise HTTPException(status_code=404, detail="Filme não encontrado")
 
-def player_page_html(nome_formatado: str, filename: str, server_url: str, download_url: str) -> str:
+def player_page_html(nome_formatado: str, filename: str, server_url: str, download_url: str,
+                     hls_url: str | None = None, meta: dict | None = None) -> str:
     subtitle_path = get_subtitle_path(filename)
     if subtitle_path is not None:
         subtitle_file = os.path.basename(subtitle_path)
@@ -1716,6 +5213,24 @@ def player_page_html(nome_formatado: str, filename: str, server_url: str, downlo
     else:
         track_tag = ""
 
+    # Com hls_url o vídeo é carregado pelo hls.js (ou nativamente no Safari)
+    if hls_url:
+        source_tag = ""
+    else:
+        source_tag = f'<source src="{server_url}/video?filename={filename}" type="video/mp4" />'
+
+    # Duração, resolução e áudios vindos do cache de metadados
+    info_parts = []
+    if meta:
+        summary = media_summary(meta)
+        if summary["duracao"]:
+            info_parts.append(format_duration(summary["duracao"]))
+        if summary["resolucao"]:
+            info_parts.append(summary["resolucao"])
+        if summary["audios"]:
+            info_parts.append("Áudio: " + ", ".join(re.sub(r"[^\w-]", "", str(a)) for a in summary["audios"]))
+    media_info_tag = f'<p class="media-info">{" · ".join(info_parts)}</p>' if info_parts else ""
+
     return f"""
     <!DOCTYPE html>
     <html>
@@ -1781,6 +5296,11 @@ def player_page_html(nome_formatado: str, filename: str, server_url: str, downlo
                 letter-spacing: 1px;
                 text-shadow: 2px 2px 6px rgba(0,0,0,0.6);
             }}
+            .media-info {{
+                margin: -10px 0 20px;
+                text-align: center;
+                color: #ecf0f1;
+            }}
             .buttons-container {{
                 display: flex;
                 gap: 20px;
@@ -1843,13 +5363,14 @@ def player_page_html(nome_formatado: str, filename: str, server_url: str, downlo
         </div>
         <div class="content">
           <h1>{nome_formatado}</h1>
+          {media_info_tag}
           <div class="buttons-container">
             <a href="{server_url}" class="btn">Início</a>
             <a href="{download_url}" class="btn" target="_blank">Baixar</a>
           </div>
           <div id="player-container">
             <video id="player" playsinline controls>
-              <source src="{server_url}/video?filename={filename}" type="video/mp4" />
+              {source_tag}
               {track_tag}
             </video>
           </div>
@@ -1859,8 +5380,20 @@ def player_page_html(nome_formatado: str, filename: str, server_url: str, downlo
         </div>
 
         <script src="https://cdn.plyr.io/3.7.8/plyr.js"></script>
+        <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
         <script>
-          const player = new Plyr('#player', {{
+          const video = document.getElementById('player');
+          const hlsUrl = {json.dumps(hls_url)};
+          if (hlsUrl) {{
+            if (window.Hls && Hls.isSupported()) {{
+              const hls = new Hls({{ capLevelToPlayerSize: true }});
+              hls.loadSource(hlsUrl);
+              hls.attachMedia(video);
+            }} else if (video.canPlayType('application/vnd.apple.mpegurl')) {{
+              video.src = hlsUrl;
+            }}
+          }}
+          const player = new Plyr(video, {{
             fullscreen: {{
               enabled: true,
               fallback: true,
@@ -2033,12 +5566,10 @@ def progress_page_html(nome_formatado: str, filename: str) -> str:
         const filename = "{filename}";
         const serverUrl = "{server_url}";
 
-        async function checkProgress() {{
-          try {{
-            const resp = await fetch(serverUrl + "/progress?filename=" + filename);
-            if (!resp.ok) return;
-            const data = await resp.json();
+        let finished = false;
 
+        function render(data) {{
+            if (finished) return;
             const barFill = document.getElementById('bar-fill');
             const barText = document.getElementById('bar-text');
             const etaDiv = document.getElementById('eta-info');
@@ -2054,12 +5585,29 @@ def progress_page_html(nome_formatado: str, filename: str) -> str:
               barFill.style.width = "100%";
               barText.innerText = "100%";
               etaDiv.innerHTML = "Transcodificação concluída! Carregando vídeo...";
+              finished = true;
               setTimeout(() => {{
                 window.location.reload();
               }}, 1500);
               return;
             }}
 
+            if (data.playable) {{
+              etaDiv.innerHTML = "Já dá para assistir! Carregando vídeo...";
+              finished = true;
+              setTimeout(() => {{
+                window.location.reload();
+              }}, 1000);
+              return;
+            }}
+
+            if (data.status === "queued") {{
+              etaDiv.innerHTML = data.position
+                ? "Na fila de transcodificação (posição " + data.position + ")"
+                : "Na fila de transcodificação...";
+              return;
+            }}
+
             if (data.eta > 0) {{
               let minutos = Math.floor(data.eta / 60);
               let segundos = Math.floor(data.eta % 60);
@@ -2067,30 +5615,118 @@ def progress_page_html(nome_formatado: str, filename: str) -> str:
             }} else {{
               etaDiv.innerHTML = "Aguarde...";
             }}
+        }}
+
+        async function checkProgress() {{
+          try {{
+            const resp = await fetch(serverUrl + "/progress?filename=" + encodeURIComponent(filename));
+            if (!resp.ok) return;
+            render(await resp.json());
           }} catch(e) {{
             console.log(e);
           }}
         }}
 
-        setInterval(checkProgress, 1000);
-        checkProgress();
+        function startPolling() {{
+          setInterval(checkProgress, 1000);
+          checkProgress();
+        }}
+
+        // Push via SSE; se não houver suporte ou a conexão falhar, volta ao polling
+        if (window.EventSource) {{
+          const source = new EventSource(serverUrl + "/progress/stream?filename=" + encodeURIComponent(filename));
+          source.onmessage = (event) => {{
+            const data = JSON.parse(event.data);
+            render(data);
+            if (finished || data.status === "error" || data.status === "not_found") source.close();
+          }};
+          source.onerror = () => {{
+            if (finished) return;
+            source.close();
+            startPolling();
+          }};
+        }} else {{
+          startPolling();
+        }}
       </script>
     </body>
     </html>
     """
 
+@video_app.api_route("/hls/{key}/{name}", methods=["GET", "HEAD"])
+def serve_hls(request: Request, key: str, name: str):
+    """
+    Serve o playlist e os segmentos HLS de uma transcodificação em andamento.
+    """
+    if not re.fullmatch(r"[0-9a-f]{16}", key) or not HLS_FILE_RE.match(name):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    path = os.path.join(HLS_FOLDER, key, name)
+    if name.endswith(".m3u8"):
+        # Playlist "event" cresce durante a transcodificação
+        return serve_file(request, path, "application/vnd.apple.mpegurl", {"Cache-Control": "no-cache"})
+    return serve_file(request, path, "video/mp2t", {"Cache-Control": "public, max-age=3600"})
+
+@video_app.api_route("/abr/{key}/{name}", methods=["GET", "HEAD"])
+def serve_abr_master(request: Request, key: str, name: str):
+    """
+    Serve o master playlist da escada ABR.
+    """
+    if not re.fullmatch(r"[0-9a-f]{20}", key) or name != ABR_MASTER:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    path = os.path.join(ABR_FOLDER, key, name)
+    return serve_file(request, path, "application/vnd.apple.mpegurl", {"Cache-Control": "public, max-age=300"})
+
+@video_app.api_route("/abr/{key}/{rendition}/{name}", methods=["GET", "HEAD"])
+def serve_abr_rendition(request: Request, key: str, rendition: str, name: str):
+    """
+    Serve playlists e segmentos de uma rendição. A chave muda sempre que o
+    MP4 de origem muda, então os segmentos são imutáveis.
+    """
+    if (not re.fullmatch(r"[0-9a-f]{20}", key) or not re.fullmatch(r"\d{3,4}p", rendition)
+            or not ABR_FILE_RE.match(name)):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    path = os.path.join(ABR_FOLDER, key, rendition, name)
+    if name.endswith(".m3u8"):
+        return serve_file(request, path, "application/vnd.apple.mpegurl", {"Cache-Control": "public, max-age=300"})
+    return serve_file(request, path, "video/mp2t", {"Cache-Control": "public, max-age=31536000, immutable"})
+
 @video_app.get("/progress")
-def get_transcode_progress(filename: str):
-    if filename not in transcoding_progress:
-        return {"percent": 0.0, "eta": 0.0, "status": "not_found"}
-    info = transcoding_progress[filename]
-    return {
-        "percent": info["percent"],
-        "eta": info["eta"],
-        "status": info["status"]
-    }
+async def get_transcode_progress(filename: str):
+    # No event loop: a fila só é alterada por ele, então o snapshot é consistente
+    return progress_snapshot(filename)
 
-@video_app.get("/video")
+@video_app.get("/progress/stream")
+async def stream_transcode_progress(request: Request, filename: str):
+    """
+    Server-Sent Events com o progresso da transcodificação; o stream
+    termina quando o job acaba (done/error) ou o cliente desconecta.
+    """
+    async def events():
+        queue = progress_broadcaster.subscribe(filename)
+        try:
+            snapshot = progress_snapshot(filename)
+            yield f"retry: 3000\ndata: {json.dumps(snapshot)}\n\n".encode("utf-8")
+            if snapshot["status"] in ("done", "error", "not_found"):
+                return
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield b": keepalive\n\n"
+                    continue
+                yield payload
+                status = transcoding_progress.get(filename, {}).get("status")
+                if status in ("done", "error"):
+                    return
+        finally:
+            progress_broadcaster.unsubscribe(filename, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@video_app.api_route("/video", methods=["GET", "HEAD"])
 async def stream_video(request: Request, filename: str):
     transcoded_path = os.path.join(TRANSCODED_FOLDER, filename + ".mp4")
     if os.path.isfile(transcoded_path):
@@ -2099,66 +5735,32 @@ async def stream_video(request: Request, filename: str):
         original_path = os.path.join(VIDEO_FOLDER, filename)
         if not os.path.isfile(original_path):
             raise HTTPException(status_code=404, detail="Filme não encontrado")
+        if request.method == "HEAD":
+            # HEAD não dispara nem espera a transcodificação: responde com os
+            # dados do original se ele já toca direto no navegador, senão 202
+            # (o MP4 ainda não existe, então não há tamanho para informar)
+            if cached_transcode_decision(filename) == DECISION_DIRECT:
+                return serve_file(request, original_path, "video/mp4")
+            return Response(status_code=202, media_type="video/mp4",
+                            headers={"Accept-Ranges": "bytes", "Cache-Control": "no-store"})
         final_path = await ensure_transcoded(original_path)
 
     if not os.path.isfile(final_path):
         raise HTTPException(status_code=404, detail="Falha na transcodificação")
 
-    file_size = os.path.getsize(final_path)
-    range_header = request.headers.get("range", None)
-
-    if range_header is None:
-        def iterfile():
-            with open(final_path, "rb") as f:
-                yield from f
-        return StreamingResponse(iterfile(), media_type="video/mp4")
-
-    range_value = range_header.strip().split("=")[-1]
-    try:
-        start_str, end_str = range_value.split("-")
-        start = int(start_str)
-        end = int(end_str) if end_str else file_size - 1
-    except ValueError:
-        start = 0
-        end = file_size - 1
-
-    if start >= file_size:
-        return StreamingResponse(content=None, status_code=416)
-
-    end = min(end, file_size - 1)
-    content_length = (end - start) + 1
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(content_length)
-    }
-
-    def iterfile():
-        with open(final_path, "rb") as f:
-            f.seek(start)
-            remaining = content_length
-            chunk_size = 1024 * 512
-            while remaining > 0:
-                data = f.read(min(chunk_size, remaining))
-                if not data:
-                    break
-                remaining -= len(data)
-                yield data
-
-    return StreamingResponse(
-        iterfile(),
-        media_type="video/mp4",
-        status_code=206,
-        headers=headers
-    )
+    hot_segments = get_hot_segments(final_path) if request.method != "HEAD" else None
+    return serve_file(request, final_path, "video/mp4", hot_segments=hot_segments)
 
 #########################################
 # INICIALIZAÇÃO COM UVICORN
 #########################################
 
 def start_video_server():
-    uvicorn.run(video_app, host="0.0.0.0", port=25614)
+    # Lê as pastas uma vez e passa a acompanhar as mudanças (inotify/polling)
+    folder_watcher.start()
+    # Proxies confiáveis para X-Forwarded-For (IP real no limite de tentativas)
+    uvicorn.run(video_app, host="0.0.0.0", port=25614,
+                forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"))
 
 #########################################
 # BOT DISCORD
@@ -2213,8 +5815,9 @@ async def update_filmes_loop():
     except Exception as e:
         print(f"Erro ao atualizar mensagem no canal: {e}")
 
-DISCORD_TOKEN = os.getenv('DISCORDTOKEN2')
-if DISCORD_TOKEN is None:
-    raise ValueError("A variável de ambiente 'DISCORDTOKEN' não está definida.")
+if __name__ == "__main__":
+    DISCORD_TOKEN = os.getenv('DISCORDTOKEN2')
+    if DISCORD_TOKEN is None:
+        raise ValueError("A variável de ambiente 'DISCORDTOKEN' não está definida.")
 
-bot.run(DISCORD_TOKEN)
+    bot.run(DISCORD_TOKEN)